@@ -0,0 +1,25 @@
+"""4_message_to_user_keyset_index
+
+Revision ID: 3f1c9a7e5b21
+Revises: 808986909a2d
+Create Date: 2026-10-18 12:15:02.114305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7e5b21'
+down_revision = '808986909a2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_message_to_user_uuid_created_at_id', 'message', ['to_user_uuid', 'created_at', 'id'],
+                    unique=False, postgresql_where=sa.text('is_notified'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_message_to_user_uuid_created_at_id', table_name='message')
@@ -0,0 +1,29 @@
+"""5_message.deliver_after
+
+Revision ID: c52e8d0a4f17
+Revises: 3f1c9a7e5b21
+Create Date: 2026-10-18 12:48:37.520913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52e8d0a4f17'
+down_revision = '3f1c9a7e5b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('message', sa.Column('deliver_after', sa.DateTime(), nullable=True))
+    # already pending messages are deliverable right away, dispatcher reschedules those of not available users
+    op.execute("UPDATE message SET deliver_after = created_at WHERE NOT is_notified")
+    op.create_index('ix_message_deliver_after_pending', 'message', ['deliver_after'],
+                    unique=False, postgresql_where=sa.text('NOT is_notified'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_message_deliver_after_pending', table_name='message')
+    op.drop_column('message', 'deliver_after')
@@ -1,30 +1,39 @@
 import fastapi as fa
 import pydantic as pd
 
+from core.config import settings
 from core.dependencies import (
     current_user_dependency,
-    sqlalchemy_repo_sync_dependency,
+    sqlalchemy_repo_async_dependency,
 )
-from core.exceptions import UnauthorizedException
+from core.enums import ResponseDetailEnum
+from core.exceptions import NotFoundException, UnauthorizedException
+from core.pagination import decode_cursor, encode_cursor
 from db.models.message import MessageModel
 from db.models.user import UserModel
-from db.repository_sync import SqlAlchemyRepositorySync
-from db.serializers.message import MessageReadSerializer, MessageUpdateSerializer
+from db.repository_async import SqlAlchemyRepositoryAsync
+from db.serializers.message import MessagePageSerializer, MessageReadSerializer, MessageUpdateSerializer
 
 router = fa.APIRouter()
 
 
 @router.get("/to-me",
-            response_model=list[MessageReadSerializer]
+            response_model=MessagePageSerializer
             )
 async def messages_list_all_to_me(
+        limit: int = fa.Query(default=settings.MESSAGES_PAGE_SIZE, ge=1, le=settings.MESSAGES_PAGE_SIZE_MAX),
+        cursor: str | None = fa.Query(default=None, description='next_cursor of the previous page'),
+        is_read: bool | None = fa.Query(default=None),
         current_user: UserModel = fa.Depends(current_user_dependency),
-        repo: SqlAlchemyRepositorySync = fa.Depends(sqlalchemy_repo_sync_dependency),
+        repo: SqlAlchemyRepositoryAsync = fa.Depends(sqlalchemy_repo_async_dependency),
 ):
     """
-    get messages sent to current user
+    get page of messages sent to current user, newest first
     """
-    return await repo.get(MessageModel, to_user_uuid=current_user.uuid, is_notified=True)
+    filters = {} if is_read is None else {'is_read': is_read}
+    messages, next_cursor = await repo.get_page_by_keyset(
+        MessageModel, limit, decode_cursor(cursor), to_user_uuid=current_user.uuid, is_notified=True, **filters)
+    return {'items': messages, 'next_cursor': encode_cursor(next_cursor)}
 
 
 @router.get("/{message_uuid}",
@@ -33,12 +42,14 @@ async def messages_list_all_to_me(
 async def messages_read(
         message_uuid: pd.UUID4 = fa.Path(...),
         current_user: UserModel = fa.Depends(current_user_dependency),
-        repo: SqlAlchemyRepositorySync = fa.Depends(sqlalchemy_repo_sync_dependency),
+        repo: SqlAlchemyRepositoryAsync = fa.Depends(sqlalchemy_repo_async_dependency),
 ):
     """
     get message by uuid
     """
-    message = repo.get(MessageModel, uuid=message_uuid.hex)
+    message = await repo.get(MessageModel, uuid=str(message_uuid))
+    if message is None:
+        raise NotFoundException
     if message.to_user_uuid != current_user.uuid:
         raise UnauthorizedException
 
@@ -50,14 +61,12 @@ async def messages_read(
             )
 async def messages_update_mark_read_many(
         message_uuid_list: list[pd.UUID4] = fa.Body(...),
-        repo: SqlAlchemyRepositorySync = fa.Depends(sqlalchemy_repo_sync_dependency),
+        repo: SqlAlchemyRepositoryAsync = fa.Depends(sqlalchemy_repo_async_dependency),
 ):
     """
     set to messages from message_id_list 'is_read'=True
     """
-    messages = repo.get_many_by_uuid_list(MessageModel, message_uuid_list)
-    repo.update_many(messages, {'is_read': True})
-    return messages
+    return await repo.update_many_by_uuid_list(MessageModel, message_uuid_list, {'is_read': True})
 
 
 @router.put("/{message_uuid}",
@@ -67,35 +76,36 @@ async def messages_update(
         message_uuid: pd.UUID4 = fa.Path(...),
         message_ser: MessageUpdateSerializer = fa.Body(...),
         current_user: UserModel = fa.Depends(current_user_dependency),
-        repo: SqlAlchemyRepositorySync = fa.Depends(sqlalchemy_repo_sync_dependency),
+        repo: SqlAlchemyRepositoryAsync = fa.Depends(sqlalchemy_repo_async_dependency),
 ):
     """
     update message by uuid
     """
-    message = repo.get(MessageModel, uuid=message_uuid)
-    message = repo.update(message, message_ser)
-    return message
+    message = await repo.get(MessageModel, uuid=str(message_uuid))
+    if message is None:
+        raise NotFoundException
+    return await repo.update(message, message_ser)
 
 
 @router.delete("/many")
 async def messages_delete_many(
         message_uuid_list: list[pd.UUID4] = fa.Body(...),
-        repo: SqlAlchemyRepositorySync = fa.Depends(sqlalchemy_repo_sync_dependency),
+        repo: SqlAlchemyRepositoryAsync = fa.Depends(sqlalchemy_repo_async_dependency),
 ):
     """
     delete many messages from id_list
     """
-    repo.remove_many_by_uuid_list(MessageModel, message_uuid_list)
-    return {'message': 'ok'}
+    await repo.remove_many_by_uuid_list(MessageModel, message_uuid_list)
+    return {'message': ResponseDetailEnum.ok}
 
 
-@router.delete("/{message_id}")
+@router.delete("/{message_uuid}")
 async def messages_delete(
         message_uuid: pd.UUID4 = fa.Path(...),
-        repo: SqlAlchemyRepositorySync = fa.Depends(sqlalchemy_repo_sync_dependency),
+        repo: SqlAlchemyRepositoryAsync = fa.Depends(sqlalchemy_repo_async_dependency),
 ):
     """
     delete message
     """
-    repo.remove(MessageModel, message_uuid)
-    return {'message': 'ok'}
+    await repo.remove_by_uuid(MessageModel, message_uuid)
+    return {'message': ResponseDetailEnum.ok}
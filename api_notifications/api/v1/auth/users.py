@@ -1,6 +1,7 @@
 import fastapi as fa
 
 from core.dependencies import current_user_dependency, sqlalchemy_repo_async_dependency
+from db.models.user import UserModel
 from db.repository_async import SqlAlchemyRepositoryAsync
 from db.serializers.user import UserReadSerializer, UserMeUpdateSerializer
 
@@ -10,7 +11,9 @@ router = fa.APIRouter()
 @router.put("/me", response_model=UserReadSerializer)
 async def users_update_me(
         user_ser: UserMeUpdateSerializer,
-        current_user=fa.Depends(current_user_dependency),
+        current_user: UserModel = fa.Depends(current_user_dependency),
         repo: SqlAlchemyRepositoryAsync = fa.Depends(sqlalchemy_repo_async_dependency),
 ):
-    return await repo.update(current_user, user_ser)
+    # current_user may be cached transient obj, the row is loaded to update it
+    user = await repo.get(UserModel, uuid=current_user.uuid)
+    return await repo.update(user, user_ser)
@@ -1,7 +1,8 @@
 import fastapi as fa
 import pydantic as pd
 
-from core.enums import ResponseDetailEnum, TaskPriorityEnum
+from core.enums import NotificationChannelEnum, ResponseDetailEnum, TaskPriorityEnum
+from core.metrics import observe_delivery
 from db import SessionLocal
 from db.repository_sync import SqlAlchemyRepositorySync
 from services.notificator.celery_tasks import (
@@ -13,6 +14,7 @@ from services.notificator.celery_tasks import (
 )
 from services.notificator.message_preparer import validate_placeholders
 from services.notificator.notificator import Notificator
+from services.notificator.rate_limiter import rate_limiters
 
 router = fa.APIRouter()
 
@@ -26,12 +28,12 @@ async def notifications_send_email(
     if as_celery_task:
         task = send_email_task.apply_async(
             kwargs={'email_to': email_to, 'msg_text': msg_text},
-            priority=TaskPriorityEnum.email_task_priority,
-            queue='default')
+            priority=TaskPriorityEnum.email_task_priority)
         return {'detail': ResponseDetailEnum.ok, 'task_id': f'{task.task_id}'}
 
     notificator = Notificator(repo=None)
-    await notificator.send_email(email_to, msg_text)
+    status = await notificator.send_email(email_to, msg_text)
+    observe_delivery(NotificationChannelEnum.email, status)
     return {'detail': ResponseDetailEnum.ok}
 
 
@@ -46,15 +48,14 @@ async def notifications_send_individual_immediate_message(
     if as_celery_task:
         task = send_individual_immediate_message_task.apply_async(
             kwargs={'user_uuid': user_uuid.hex, 'msg_text': msg_text},
-            priority=TaskPriorityEnum.individual_immediate_message_task_priority,
-            queue='default')
+            priority=TaskPriorityEnum.individual_immediate_message_task_priority)
         return {'detail': ResponseDetailEnum.ok, 'task_id': f'{task.task_id}'}
 
     repo = SqlAlchemyRepositorySync(SessionLocal())
     notificator = Notificator(repo)
-    await notificator.send_individual_immediate_message(user_uuid.hex, msg_text)
+    delivery = await notificator.send_individual_immediate_message(user_uuid.hex, msg_text)
     repo.session.close()
-    return {'detail': ResponseDetailEnum.ok}
+    return {'detail': ResponseDetailEnum.ok, 'delivery': delivery}
 
 
 @router.post("/send-individual-pending-message")
@@ -68,8 +69,7 @@ async def notifications_send_individual_pending_message(
     if as_celery_task:
         task = send_individual_pending_message_task.apply_async(
             kwargs={'user_uuid': user_uuid.hex, 'msg_text': msg_text},
-            priority=TaskPriorityEnum.individual_pending_message_task_priority,
-            queue='default')
+            priority=TaskPriorityEnum.individual_pending_message_task_priority)
         return {'detail': ResponseDetailEnum.ok, 'task_id': f'{task.task_id}'}
 
     repo = SqlAlchemyRepositorySync(SessionLocal())
@@ -91,15 +91,14 @@ async def notifications_send_mass_message_to_filtered_users(
     if as_celery_task:
         task = send_mass_message_to_filtered_users_task.apply_async(
             kwargs={'user_uuid_list': user_uuid_list, 'msg_text': msg_text},
-            priority=TaskPriorityEnum.mass_message_for_filtered_users_task_priority,
-            queue='default')
+            priority=TaskPriorityEnum.mass_message_for_filtered_users_task_priority)
         return {'detail': ResponseDetailEnum.ok, 'task_id': f'{task.task_id}'}
 
     repo = SqlAlchemyRepositorySync(SessionLocal())
     notificator = Notificator(repo)
-    await notificator.send_mass_message_to_user_uuid_list(user_uuid_list, msg_text)
+    report = await notificator.send_mass_message_to_user_uuid_list(user_uuid_list, msg_text)
     repo.session.close()
-    return {'detail': ResponseDetailEnum.ok}
+    return {'detail': ResponseDetailEnum.ok, 'report': report.as_dict()}
 
 
 @router.post("/send-mass-message-to-all-users")
@@ -112,12 +111,17 @@ async def notifications_send_mass_message_to_all_users(
     if as_celery_task:
         task = send_mass_message_to_all_users_task.apply_async(
             kwargs={'msg_text': msg_text},
-            priority=TaskPriorityEnum.mass_message_for_all_users_task_priority,
-            queue='default')
+            priority=TaskPriorityEnum.mass_message_for_all_users_task_priority)
         return {'detail': ResponseDetailEnum.ok, 'task_id': f'{task.task_id}'}
 
     repo = SqlAlchemyRepositorySync(SessionLocal())
     notificator = Notificator(repo)
-    await notificator.send_mass_message_to_all_users(msg_text)
+    report = await notificator.send_mass_message_to_all_users(msg_text)
     repo.session.close()
-    return {'detail': ResponseDetailEnum.ok}
+    return {'detail': ResponseDetailEnum.ok, 'report': report.as_dict()}
+
+
+@router.get("/rate-limits")
+async def notifications_rate_limits():
+    """current throttle state of outbound channels"""
+    return {str(channel): await limiter.state() for channel, limiter in rate_limiters.items()}
@@ -2,8 +2,11 @@ import fastapi as fa
 import pydantic as pd
 
 from core.dependencies import sqlalchemy_repo_async_dependency
+from core.enums import ResponseDetailEnum
 from db.repository_async import SqlAlchemyRepositoryAsync
 from db.serializers.user import UserReadSerializer
+from services.notificator.auth_user_cache import auth_user_data_cache
+from services.notificator.message_preparer import invalidate_auth_users_data
 
 router = fa.APIRouter()
 
@@ -15,3 +18,18 @@ async def users_duplicate(
         repo: SqlAlchemyRepositoryAsync = fa.Depends(sqlalchemy_repo_async_dependency),
 ):
     return await repo.get_or_create_duplicated_user(user_uuid, user_email)
+
+
+@router.post("/invalidate-auth-user-data")
+async def users_invalidate_auth_user_data(
+        user_uuid_list: list[pd.UUID4] = fa.Body(..., embed=True),
+):
+    """auth service calls it after user data used in placeholders is changed,
+    cached data in other worker processes expires after AUTH_USER_CACHE_TTL"""
+    invalidate_auth_users_data(user_uuid_list)
+    return {'detail': ResponseDetailEnum.ok}
+
+
+@router.get("/auth-user-data-cache")
+async def users_auth_user_data_cache_stats():
+    return auth_user_data_cache.stats()
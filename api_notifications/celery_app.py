@@ -1,19 +1,72 @@
 import os
+import time
 
 from celery import Celery
+from celery.signals import beat_init, task_postrun, task_prerun, worker_init, worker_process_shutdown
 from kombu import Exchange, Queue
+from prometheus_client import multiprocess, start_http_server
 
-from core.config import settings
-from db import DATABASE_NOTIFICATIONS_URL_SYNC
+from core.config import CELERY_BEAT_SCHEDULE, CELERY_TASK_ROUTES, settings
+from core.enums import CeleryQueueEnum
+from core.metrics import CELERY_TASK_SECONDS, MULTIPROCESS, get_registry
+from core.logger_config import logger
+from db import DATABASE_NOTIFICATIONS_URL_SYNC, SessionLocal
+from db.models.celery_tasks import PeriodicTaskModel
+from db.repository_sync import SqlAlchemyRepositorySync
+from db.serializers.celery_tasks import PeriodicTaskCreateSchedulesSerializer
 
 celery_app = Celery(__name__, broker=settings.CELERY_BROKER_URL, backend=settings.CELERY_RESULT_BACKEND)
 celery_app.conf.timezone = settings.CELERY_TIMEZONE
-celery_app.conf.task_queues = (
-    Queue('default', Exchange('default'), routing_key='default', queue_arguments={'x-max-priority': 10}),
+celery_app.conf.task_queues = tuple(
+    Queue(queue.value, Exchange(queue.value), routing_key=queue.value, queue_arguments={'x-max-priority': 10})
+    for queue in CeleryQueueEnum
 )
+celery_app.conf.task_default_queue = CeleryQueueEnum.default.value
+celery_app.conf.task_routes = {task: {'queue': queue.value} for task, queue in CELERY_TASK_ROUTES.items()}
 
 celery_app.conf.update({'beat_dburi': DATABASE_NOTIFICATIONS_URL_SYNC})
 
+_task_started_at: dict[str, float] = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id, task, **kwargs):
+    _task_started_at[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task_duration(task_id, task, state=None, **kwargs):
+    started_at = _task_started_at.pop(task_id, None)
+    if started_at is not None:
+        CELERY_TASK_SECONDS.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started_at)
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    """worker main process exports metrics of pool processes (prefork pool needs PROMETHEUS_MULTIPROC_DIR)"""
+    if settings.METRICS_WORKER_PORT:
+        try:
+            start_http_server(settings.METRICS_WORKER_PORT, registry=get_registry())
+        except OSError as e:
+            logger.warning(f'celery metrics server is not started on {settings.METRICS_WORKER_PORT=:}: {e}')
+
+
+@beat_init.connect
+def install_beat_schedule(**kwargs):
+    """create periodic tasks of CELERY_BEAT_SCHEDULE which aren't in db yet (by name), before scheduler reads it"""
+    repo = SqlAlchemyRepositorySync(SessionLocal())
+    for name, entry in CELERY_BEAT_SCHEDULE.items():
+        if repo.session.query(PeriodicTaskModel).filter_by(name=name).first() is None:
+            repo.create_periodic_task_with_schedule(PeriodicTaskCreateSchedulesSerializer(name=name, **entry))
+            logger.info(f'periodic task {name} is created')
+    repo.session.close()
+
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid=None, **kwargs):
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid or os.getpid())
+
 
 def import_celery_tasks_from_services():
     root, subdirs, files = next(os.walk(f'{os.getcwd()}/services/'))
@@ -3,14 +3,19 @@ from pathlib import Path
 
 import pydantic as pd
 import pydantic_settings as ps
-from celery.schedules import crontab
 
-from core.enums import TaskPriorityEnum
+from core.enums import CeleryQueueEnum
 
 
 class Settings(ps.BaseSettings):
     API_AUTH_HOST: str
     API_AUTH_PORT: int
+    AUTH_HTTP_TIMEOUT: float = 5.0
+    AUTH_HTTP_MAX_CONNECTIONS: int = 50
+    AUTH_TOKEN_CACHE_SIZE: int = 10000
+    AUTH_TOKEN_CACHE_MAX_TTL: int = 300
+    CURRENT_USER_CACHE_SIZE: int = 10000
+    CURRENT_USER_CACHE_TTL: int = 60
 
     API_NOTIFICATIONS_HOST: str
     API_NOTIFICATIONS_PORT: int
@@ -20,8 +25,57 @@ class Settings(ps.BaseSettings):
 
     SMTP_HOST: str
     SMTP_PORT: int
+    SMTP_TIMEOUT: int = 10
+    SMTP_POOL_SIZE: int = 4
+    SMTP_POOL_IDLE_CHECK_SECONDS: int = 30
+    EMAIL_MAX_CONCURRENCY: int = 4
+    # recipients of one smtp transaction of mass emails, 1 - transaction (and To header) per recipient
+    EMAIL_BATCH_RECIPIENTS: int = 1
+    MASS_MESSAGE_MAX_CONCURRENCY: int = 32
+    MASS_MESSAGE_CHUNK_SIZE: int = 1000
+    MASS_MESSAGE_SHARD_SIZE: int = 10000
+    MESSAGE_TEMPLATE_CACHE_SIZE: int = 256
+    PENDING_DISPATCH_BATCH_SIZE: int = 500
+    # celery tasks run notificator coroutines in one long-lived event loop per worker process, so telegram/redis
+    # clients opened in it are reused by next tasks, False - fresh loop (and clients) per task
+    NOTIFICATOR_PERSISTENT_LOOP: bool = True
+    PENDING_DISPATCH_RANGE_SIZE: int = 5000
+    PENDING_DISPATCH_INTERVAL_SECONDS: int = 60
+    # pending messages of one user claimed together are delivered by email/telegram as digests of up to
+    # PENDING_DIGEST_MAX_MESSAGES messages and PENDING_DIGEST_MAX_CHARS (telegram limits message to 4096)
+    PENDING_DIGEST: bool = False
+    PENDING_DIGEST_MAX_MESSAGES: int = 20
+    PENDING_DIGEST_MAX_CHARS: int = 3500
+    # pending message nobody got by email/telegram because they failed or were throttled is rescheduled
+    # in PENDING_RETRY_SECONDS (or when the channel block ends), until it is PENDING_RETRY_MAX_AGE_SECONDS old
+    PENDING_RETRY_SECONDS: int = 300
+    PENDING_RETRY_MAX_AGE_SECONDS: int = 86400
+    AUTH_USER_CACHE_SIZE: int = 10000
+    AUTH_USER_CACHE_TTL: int = 60
+    AUTH_USER_CACHE_REDIS: bool = False
+    AUTH_USER_CACHE_REDIS_TTL: int = 600
+    MESSAGES_PAGE_SIZE: int = 50
+    MESSAGES_PAGE_SIZE_MAX: int = 200
+    # timeouts of one smtp send / telegram request, waits for rate limiter tokens and blocks aren't counted
+    EMAIL_CHANNEL_TIMEOUT: float = 30.0
+    TELEGRAM_CHANNEL_TIMEOUT: float = 15.0
+    RATE_LIMIT_REDIS: bool = True
+    RATE_LIMIT_REDIS_TIMEOUT: float = 0.5
+    RATE_LIMIT_REDIS_RETRY_SECONDS: int = 30
+    EMAIL_RATE_LIMIT: float = 10.0
+    EMAIL_RATE_BURST: int = 20
+    EMAIL_THROTTLE_BACKOFF_SECONDS: int = 30
+    TELEGRAM_RATE_LIMIT: float = 25.0
+    TELEGRAM_RATE_BURST: int = 25
+    TELEGRAM_MAX_RETRIES: int = 2
     EMAILS_FROM_EMAIL: pd.EmailStr
     TG_BOT_ID: str
+    TG_API_URL: str = 'https://api.telegram.org'
+    TG_HTTP2: bool = False
+    TG_HTTP_TIMEOUT: float = 10.0
+    TG_HTTP_MAX_CONNECTIONS: int = 30
+    TG_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 30
+    TG_HTTP_KEEPALIVE_EXPIRY: float = 60.0
 
     REDIS_HOST: str
     REDIS_PORT: int
@@ -43,6 +97,22 @@ class Settings(ps.BaseSettings):
     CELERY_BROKER_URL: str
     CELERY_RESULT_BACKEND: str
     CELERY_TIMEZONE: str
+    # celery worker main process serves /metrics of all its pool processes on this port, 0 - not served
+    METRICS_WORKER_PORT: int = 9808
+    # /metrics of the api is served only to clients of these networks (prometheus on the docker/private network)
+    METRICS_ALLOWED_NETWORKS: list[str] = ['127.0.0.0/8', '::1/128', '10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16']
+    # worker name -> queues it consumes (in order of preference), pool and concurrency,
+    # started by /start_celeryworker with CELERY_WORKER_NAME, workers are sized independently
+    # so mass sends never take slots of immediate ones; json in env overrides the whole mapping;
+    # immediate sends are i/o bound: threads of one process share its event loop, connections and smtp pool
+    CELERY_WORKERS: dict[str, dict] = {
+        'immediate': {'queues': [CeleryQueueEnum.immediate.value, CeleryQueueEnum.email.value],
+                      'pool': 'threads', 'concurrency': 8},
+        'pending': {'queues': [CeleryQueueEnum.pending.value],
+                    'pool': 'prefork', 'concurrency': 4},
+        'mass': {'queues': [CeleryQueueEnum.mass.value, CeleryQueueEnum.default.value],
+                 'pool': 'prefork', 'concurrency': 4},
+    }
 
     class Config:
         extra = 'allow'
@@ -70,18 +140,27 @@ settings = Settings(DOCKER, DEBUG, BASE_DIR)
 
 USER_NOTIFICATION_AVAILABLE_HOURS = [9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20]
 
+# task name -> queue, not listed tasks go to CeleryQueueEnum.default
+CELERY_TASK_ROUTES = {
+    'send_email_task': CeleryQueueEnum.email,
+    'send_individual_immediate_message_task': CeleryQueueEnum.immediate,
+    'send_individual_pending_message_task': CeleryQueueEnum.immediate,
+    'check_availability_and_notify_pending_messages_by_uuid_list_task': CeleryQueueEnum.pending,
+    'check_availability_and_notify_pending_messages_all_task': CeleryQueueEnum.pending,
+    'dispatch_pending_messages_task': CeleryQueueEnum.pending,
+    'send_mass_message_to_filtered_users_task': CeleryQueueEnum.mass,
+    'send_mass_message_to_filtered_users_shard_task': CeleryQueueEnum.mass,
+    'send_mass_message_to_all_users_task': CeleryQueueEnum.mass,
+    'send_mass_message_to_all_users_shard_task': CeleryQueueEnum.mass,
+    'aggregate_mass_message_reports_task': CeleryQueueEnum.mass,
+}
+
+# periodic task name -> fields of PeriodicTaskCreateSchedulesSerializer, beat creates missing ones in notifications
+# postgres on start (DatabaseScheduler reads only the db), existing ones are left as changed through the api
 CELERY_BEAT_SCHEDULE = {
-    'deliver_pending_messages_task': {
-        'task': 'deliver_pending_messages_task',
-        'schedule': crontab(hour='*', day_of_week='*'),
-        'options': {'priority': TaskPriorityEnum.check_pending_messages_task_priority,
-                    'queue': 'default'}
-    },
-    'send_email_task': {
-        'task': 'send_email_task',
-        'schedule': crontab(minute='*', day_of_week='*'),
-        'kwargs': {'email_to': 'prapeller@mail', 'msg_text': 'test'},
-        'options': {'priority': TaskPriorityEnum.email_task_priority,
-                    'queue': 'default'}
+    # fans deliverable pending messages out to dispatch_pending_messages_task by id ranges
+    'check_availability_and_notify_pending_messages_all_task': {
+        'task': 'check_availability_and_notify_pending_messages_all_task',
+        'interval': {'every': settings.PENDING_DISPATCH_INTERVAL_SECONDS, 'period': 'seconds'},
     },
 }
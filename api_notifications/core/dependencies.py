@@ -1,14 +1,22 @@
+import base64
+import binascii
+import hashlib
+import ipaddress
 import json
+import time
 
 import fastapi as fa
 import httpx
 from fastapi.security import OAuth2PasswordBearer
 
+from core.cache import TTLCache
 from core.config import settings
 from core.enums import ServicesNamesEnum
 from core.exceptions import UnauthorizedException
+from core.http_client import AsyncHTTPClientHolder
 from core.logger_config import logger
 from db import SessionLocalAsync, SessionLocal
+from db.expressions import normalize_uuids
 from db.models.user import UserModel
 from db.repository_async import SqlAlchemyRepositoryAsync
 from db.repository_sync import SqlAlchemyRepositorySync
@@ -55,11 +63,35 @@ oauth2_scheme_local = OAuth2PasswordBearer(
     tokenUrl=f"http://{settings.API_AUTH_HOST}:{settings.API_AUTH_PORT}/api/v1/auth/login")
 
 
+auth_http_client = AsyncHTTPClientHolder(
+    'auth',
+    base_url=f"http://{settings.API_AUTH_HOST}:{settings.API_AUTH_PORT}",
+    timeout=settings.AUTH_HTTP_TIMEOUT,
+    limits=httpx.Limits(max_connections=settings.AUTH_HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=settings.AUTH_HTTP_MAX_CONNECTIONS),
+)
+
+# verified token payloads by hash of token and client data it was verified with,
+# entries live until token "exp" but at most AUTH_TOKEN_CACHE_MAX_TTL (bounds delay of noticing logout)
+verified_tokens_cache = TTLCache(settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_CACHE_MAX_TTL)
+
+# id of user by (uuid, email) it was already duplicated to notifications postgres with
+current_users_cache = TTLCache(settings.CURRENT_USER_CACHE_SIZE, settings.CURRENT_USER_CACHE_TTL)
+
+
+def get_token_exp(access_token: str) -> float | None:
+    """"exp" claim of jwt payload, signature isn't checked, it's used only for already verified token"""
+    try:
+        payload = access_token.split('.')[1]
+        return float(json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['exp'])
+    except (IndexError, KeyError, TypeError, ValueError, binascii.Error):
+        return None
+
+
 async def verified_access_token_dependency(
         request: fa.Request,
         access_token: str = fa.Depends(oauth2_scheme_local),
 ) -> dict:
-    url = f"http://{settings.API_AUTH_HOST}:{settings.API_AUTH_PORT}/api/v1/auth/verify-access-token"
     headers = {
         'accept': 'application/json',
         'Content-Type': 'application/json',
@@ -69,11 +101,20 @@ async def verified_access_token_dependency(
         'ip': request.headers.get('X-Forwarded-For'),
         'access_token': access_token,
     }
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(url, headers=headers, json=data)
+    cache_key = hashlib.sha256(f"{access_token}\0{data['useragent']}\0{data['ip']}".encode()).hexdigest()
+    verified_token = verified_tokens_cache.get(cache_key)
+    if verified_token is not None:
+        return verified_token
+    resp = await auth_http_client.get().post('/api/v1/auth/verify-access-token', headers=headers, json=data)
     if resp.status_code != fa.status.HTTP_200_OK:
         raise UnauthorizedException
-    return json.loads(resp.text)
+    verified_token = json.loads(resp.text)
+    exp = verified_token.get('exp') if isinstance(verified_token, dict) else None
+    exp = exp or get_token_exp(access_token)
+    if exp is not None:
+        verified_tokens_cache.set(cache_key, verified_token,
+                                  ttl=min(float(exp) - time.time(), settings.AUTH_TOKEN_CACHE_MAX_TTL))
+    return verified_token
 
 
 async def verify_service_secret_dependency(
@@ -89,9 +130,38 @@ async def verify_service_secret_dependency(
         raise UnauthorizedException(detail)
 
 
+metrics_allowed_networks = [ipaddress.ip_network(network) for network in settings.METRICS_ALLOWED_NETWORKS]
+
+
+async def verify_metrics_client_dependency(
+        request: fa.Request,
+) -> None:
+    """client address is the peer of the connection, not a header, so it can't be forged by the client"""
+    host = request.client.host if request.client else None
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        address = None
+    if address is None or not any(address in network for network in metrics_allowed_networks):
+        detail = f"metrics aren't served to {host=:}"
+        logger.warning(detail)
+        raise UnauthorizedException(detail)
+
+
 async def current_user_dependency(
         repo: SqlAlchemyRepositoryAsync = fa.Depends(sqlalchemy_repo_async_dependency),
         verified_token: dict = fa.Depends(verified_access_token_dependency)) -> UserModel:
-    current_uuid = verified_token.get('sub')
+    """user of verified token duplicated to notifications postgres, for (uuid, email) duplicated in the last
+    CURRENT_USER_CACHE_TTL seconds db isn't queried: transient UserModel with only id, uuid and email is returned"""
+    try:
+        # the same user is cached and looked up under one key whatever form of uuid the token has
+        current_uuid = normalize_uuids([verified_token.get('sub')])[0]
+    except (TypeError, ValueError, AttributeError):
+        raise UnauthorizedException(f"can't get user uuid from token: {verified_token.get('sub')=:}")
     current_email = verified_token.get('email')
-    return await repo.get_or_create_duplicated_user(current_uuid, current_email)
+    user_id = current_users_cache.get((current_uuid, current_email))
+    if user_id is not None:
+        return UserModel(id=user_id, uuid=current_uuid, email=current_email)
+    user = await repo.get_or_create_duplicated_user(current_uuid, current_email)
+    current_users_cache.set((current_uuid, current_email), user.id)
+    return user
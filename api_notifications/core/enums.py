@@ -27,6 +27,8 @@ class ResponseDetailEnum(str, Enum):
     ok = 'ok'
     unauthorized = 'Unauthorized for this action.'
     bad_request = 'Bad reqeust.'
+    not_found = 'Not found.'
+    not_valid_cursor = 'Not valid cursor.'
     auth_postgres_error = 'Unable to get info from auth_postgres: '
     not_valid_placeholders = (f'Only the following placeholders are valid:'
                               f'{[p.value for p in UserDataRenderPlaceholdersEnum]}. '
@@ -106,6 +108,32 @@ class MessagePriorityEnum(int, Enum):
         return str(self)
 
 
+class NotificationChannelEnum(str, Enum):
+    email = 'email'
+    telegram = 'telegram'
+    interface = 'interface'
+
+    def __str__(self):
+        return str(self.value)
+
+    def __repr__(self):
+        return str(self)
+
+
+class DeliveryStatusEnum(str, Enum):
+    delivered = 'delivered'
+    skipped = 'skipped'
+    failed = 'failed'
+    # provider asked to slow down / retry later
+    throttled = 'throttled'
+
+    def __str__(self):
+        return str(self.value)
+
+    def __repr__(self):
+        return str(self)
+
+
 class NotificatorCeleryTasksEnum(str, Enum):
     send_email_task = 'send_email_task'
     send_individual_immediate_message_task = 'send_individual_immediate_message_task'
@@ -121,6 +149,20 @@ class NotificatorCeleryTasksEnum(str, Enum):
         return str(self)
 
 
+class CeleryQueueEnum(str, Enum):
+    immediate = 'immediate'
+    email = 'email'
+    pending = 'pending'
+    mass = 'mass'
+    default = 'default'
+
+    def __str__(self):
+        return str(self.value)
+
+    def __repr__(self):
+        return str(self)
+
+
 class UTCTimeZonesEnum(str, Enum):
     utc_p14 = "UTC+14"
     utc_p13 = "UTC+13"
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+from collections.abc import Callable, Coroutine
+
+from core.logger_config import logger
+
+
+class BackgroundEventLoop:
+    """one long-lived event loop per process, running forever in a daemon thread,
+    coroutines are submitted to it from any thread and run concurrently with coroutines of other threads,
+    so connections opened in the loop (http clients, semaphores etc. bound to it) live as long as the process"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        """started lazily, so a loop is never inherited by forked worker processes"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run, args=(self._loop,),
+                                                name=f'{self.name}-event-loop', daemon=True)
+                self._thread.start()
+                logger.debug(f'{self.name} event loop started')
+            return self._loop
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def run(self, coro: Coroutine, timeout: float | None = None):
+        """run coroutine in the loop and block calling thread until it's done, returns its result"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, cleanup: Callable[[], Coroutine] | None = None, timeout: float = 10) -> None:
+        """await cleanup() in the loop (e.g. closing its clients), then stop the loop and wait for its thread"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None or loop.is_closed():
+            return
+        if cleanup is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(cleanup(), loop).result(timeout)
+            except Exception as e:
+                logger.error(f'{self.name} event loop cleanup failed: {e}')
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        logger.debug(f'{self.name} event loop stopped')
+
+    def reset(self) -> None:
+        """forget loop of the parent after fork, its thread doesn't exist in the child"""
+        self._loop = self._thread = None
+        self._lock = threading.Lock()
@@ -27,6 +27,14 @@ class NotValidPlaceholdersException(fa.HTTPException):
         )
 
 
+class NotFoundException(fa.HTTPException):
+    def __init__(self, detail=None):
+        super().__init__(
+            status_code=fa.status.HTTP_404_NOT_FOUND,
+            detail=ResponseDetailEnum.not_found if detail is None else detail,
+        )
+
+
 class UnauthorizedException(fa.HTTPException):
     def __init__(self, detail=None):
         super().__init__(
@@ -0,0 +1,35 @@
+import asyncio
+import importlib.util
+import weakref
+
+import httpx
+
+from core.logger_config import logger
+
+
+class AsyncHTTPClientHolder:
+    """keeps one pooled httpx.AsyncClient per event loop (connections can't be shared between loops),
+    client is opened lazily by first .get() and lives until .aclose() is awaited on the same loop"""
+
+    def __init__(self, name: str, http2: bool = False, **client_kwargs):
+        self.name = name
+        if http2 and importlib.util.find_spec('h2') is None:
+            logger.warning(f'{name} http client: http2 requested but "h2" package is not installed, using http/1.1')
+            http2 = False
+        self.client_kwargs = {'http2': http2, **client_kwargs}
+        self._clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient] = \
+            weakref.WeakKeyDictionary()
+
+    def get(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = self._clients[loop] = httpx.AsyncClient(**self.client_kwargs)
+            logger.debug(f'{self.name} http client opened')
+        return client
+
+    async def aclose(self) -> None:
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None and not client.is_closed:
+            await client.aclose()
+            logger.debug(f'{self.name} http client closed')
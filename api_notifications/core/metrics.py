@@ -0,0 +1,86 @@
+import os
+import time
+
+import sqlalchemy as sa
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+from core.enums import DeliveryStatusEnum, NotificationChannelEnum
+
+# with PROMETHEUS_MULTIPROC_DIR set (gunicorn workers, celery prefork children) every process writes its samples
+# to own files in that dir and any process can export all of them, dir must be emptied before processes start
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+DELIVERIES = Counter(
+    'notifications_deliveries_total',
+    'deliveries by channel and status (skipped - user turned the channel off, throttled - provider asked to retry later)',
+    ['channel', 'status'],
+)
+SEND_SECONDS = Histogram(
+    'notifications_send_seconds',
+    'duration of one external send (telegram request, smtp message or smtp batch)',
+    ['channel'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30),
+)
+DB_WRITE_SECONDS = Histogram(
+    'notifications_db_write_seconds',
+    'duration of insert/update/delete statements of notifications postgres',
+    ['operation'],
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+PENDING_MESSAGES = Gauge(
+    'notifications_pending_messages',
+    'not notified messages scheduled for delivery, by message priority (counted by pending dispatch fan-out task)',
+    ['priority'],
+    multiprocess_mode='mostrecent',
+)
+CELERY_TASK_SECONDS = Histogram(
+    'notifications_celery_task_seconds',
+    'celery task run duration by task name and final state',
+    ['task', 'state'],
+    buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+
+DB_WRITE_OPERATIONS = frozenset({'insert', 'update', 'delete'})
+
+
+def observe_delivery(channel: NotificationChannelEnum, status: DeliveryStatusEnum, count: int = 1) -> None:
+    if count:
+        DELIVERIES.labels(channel.value, status.value).inc(count)
+
+
+def instrument_engine(engine: sa.Engine) -> None:
+    """observe DB_WRITE_SECONDS for every write statement executed by engine"""
+
+    @sa.event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started_at', []).append(time.perf_counter())
+
+    @sa.event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_started_at'].pop()
+        operation = statement.lstrip().split(None, 1)[0].lower()
+        if operation in DB_WRITE_OPERATIONS:
+            DB_WRITE_SECONDS.labels(operation).observe(elapsed)
+
+    @sa.event.listens_for(engine, 'handle_error')
+    def handle_error(exception_context):
+        # after_cursor_execute isn't called for failed statement
+        if exception_context.connection is not None:
+            started = exception_context.connection.info.get('metrics_started_at')
+            if started:
+                started.pop()
+
+
+def get_registry() -> CollectorRegistry:
+    if not MULTIPROCESS:
+        from prometheus_client import REGISTRY
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def generate_metrics() -> tuple[bytes, str]:
+    """exposition of all metrics (of all processes in multiprocess mode) and its content type"""
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
@@ -0,0 +1,27 @@
+import base64
+import binascii
+import datetime as dt
+import json
+
+from core.enums import ResponseDetailEnum
+from core.exceptions import BadRequestException
+
+KeysetCursor = tuple[dt.datetime, int]
+
+
+def encode_cursor(cursor: KeysetCursor | None) -> str | None:
+    """opaque url-safe string of (created_at, id) of the last obj of page"""
+    if cursor is None:
+        return None
+    created_at, id = cursor
+    return base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), id]).encode()).decode()
+
+
+def decode_cursor(cursor: str | None) -> KeysetCursor | None:
+    if not cursor:
+        return None
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return dt.datetime.fromisoformat(created_at), int(id)
+    except (TypeError, ValueError, binascii.Error):
+        raise BadRequestException(ResponseDetailEnum.not_valid_cursor)
@@ -0,0 +1,31 @@
+import asyncio
+import weakref
+
+import redis.asyncio as aioredis
+
+from core.logger_config import logger
+
+
+class AsyncRedisHolder:
+    """keeps one redis.asyncio client per event loop (its connections can't be shared between loops),
+    client is created lazily by first .get() and lives until .aclose() is awaited on the same loop"""
+
+    def __init__(self, name: str, **client_kwargs):
+        self.name = name
+        self.client_kwargs = client_kwargs
+        self._clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aioredis.Redis] = \
+            weakref.WeakKeyDictionary()
+
+    def get(self) -> aioredis.Redis:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = aioredis.Redis(**self.client_kwargs)
+            logger.debug(f'{self.name} redis client opened')
+        return client
+
+    async def aclose(self) -> None:
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close(close_connection_pool=True)
+            logger.debug(f'{self.name} redis client closed')
@@ -3,6 +3,7 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 from core.config import settings
+from core.metrics import instrument_engine
 
 
 def init_models():
@@ -14,6 +15,7 @@ def init_models():
 DATABASE_NOTIFICATIONS_URL_ASYNC = f'postgresql+asyncpg://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@' \
                                    f'{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DB}'
 engine_async = create_async_engine(DATABASE_NOTIFICATIONS_URL_ASYNC, future=True)
+instrument_engine(engine_async.sync_engine)
 SessionLocalAsync = sessionmaker(engine_async, class_=AsyncSession, expire_on_commit=False)
 
 DATABASE_AUTH_URL_SYNC = f'postgresql+psycopg2://{settings.AUTH_POSTGRES_USER}:{settings.AUTH_POSTGRES_PASSWORD}@' \
@@ -24,6 +26,7 @@ SessionLocalAuthSync = sessionmaker(autocommit=False, autoflush=False, bind=engi
 DATABASE_NOTIFICATIONS_URL_SYNC = (f'postgresql+psycopg2://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@'
                                    f'{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DB}')
 engine_sync = create_engine(DATABASE_NOTIFICATIONS_URL_SYNC, pool_pre_ping=True)
+instrument_engine(engine_sync)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine_sync)
 
 Base = declarative_base()
@@ -0,0 +1,16 @@
+import uuid
+from collections.abc import Iterable
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def in_array(column: sa.Column, values: Iterable) -> sa.ColumnElement[bool]:
+    """column = ANY(CAST(:values AS <type>[])), whole list is bound as a single array parameter,
+    so statement (and its cached plan) is the same for any length and there's no bind parameters limit of IN (...)"""
+    return column == sa.any_(sa.cast(sa.bindparam(None, list(values)), postgresql.ARRAY(column.type)))
+
+
+def normalize_uuids(uuid_list: Iterable) -> list[str]:
+    """uuids in the form they are returned by sa.UUID(as_uuid=False) columns"""
+    return [str(_uuid) if isinstance(_uuid, uuid.UUID) else str(uuid.UUID(_uuid)) for _uuid in uuid_list]
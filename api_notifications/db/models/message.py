@@ -7,6 +7,14 @@ from db.models._shared import IdentifiedCreatedUpdated
 
 class MessageModel(IdentifiedCreatedUpdated, Base):
     __tablename__ = 'message'
+    __table_args__ = (
+        # keyset pagination of notified messages of user, see SqlAlchemyRepositoryAsync.get_page_by_keyset
+        sa.Index('ix_message_to_user_uuid_created_at_id', 'to_user_uuid', 'created_at', 'id',
+                 postgresql_where=sa.text('is_notified')),
+        # range scan of deliverable pending messages by dispatcher
+        sa.Index('ix_message_deliver_after_pending', 'deliver_after',
+                 postgresql_where=sa.text('NOT is_notified')),
+    )
     uuid = sa.Column(sa.UUID(as_uuid=False), server_default=sa.text("uuid_generate_v4()"),
                      unique=True, index=True, nullable=False)
 
@@ -15,6 +23,8 @@ class MessageModel(IdentifiedCreatedUpdated, Base):
     is_read = sa.Column(sa.Boolean, default=False)
     priority = sa.Column(sa.Integer, index=True)
     is_notified = sa.Column(sa.Boolean, default=False)
+    # earliest utc time pending message may be delivered at (start of user's available hours), None - not scheduled
+    deliver_after = sa.Column(sa.DateTime, nullable=True)
 
     to_user_uuid = sa.Column(sa.UUID(as_uuid=False), sa.ForeignKey('user.uuid'))
     to_user = relationship("UserModel",
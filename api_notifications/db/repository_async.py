@@ -1,15 +1,19 @@
 import abc
 
 import pydantic as pd
+import sqlalchemy as sa
 import sqlalchemy.ext.asyncio as sa_async
 from fastapi.encoders import jsonable_encoder
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.future import select
 
-from core.exceptions import BadRequestException
+from core.enums import OrderEnum
+from core.exceptions import BadRequestException, NotFoundException
+from core.pagination import KeysetCursor
 from db import Base as sa_BaseModel
+from db.expressions import in_array, normalize_uuids
 from db.models.user import UserModel
-from db.serializers.user import UserCreateSerializer, UserUpdateSerializer
 
 
 class AbstractRepositoryAsync(abc.ABC):
@@ -65,6 +69,42 @@ class SqlAlchemyRepositoryAsync(AbstractRepositoryAsync):
         objs = result.scalars().all()
         return objs
 
+    async def get_page_by_keyset(self, Model: type[sa_BaseModel], limit: int, cursor: KeysetCursor | None = None,
+                                 order: OrderEnum = OrderEnum.desc,
+                                 **kwargs) -> tuple[list[sa_BaseModel], KeysetCursor | None]:
+        """keyset pagination on (created_at, id): up to limit objs following cursor and cursor of the next page
+        (None for the last page), single select of limit + 1 rows, cost doesn't grow with page number"""
+        key = sa.tuple_(Model.created_at, Model.id)
+        stmt = select(Model).filter_by(**kwargs)
+        if order == OrderEnum.desc:
+            if cursor is not None:
+                stmt = stmt.where(key < sa.tuple_(*cursor))
+            stmt = stmt.order_by(Model.created_at.desc(), Model.id.desc())
+        else:
+            if cursor is not None:
+                stmt = stmt.where(key > sa.tuple_(*cursor))
+            stmt = stmt.order_by(Model.created_at, Model.id)
+        result = await self.session.execute(stmt.limit(limit + 1))
+        objs = list(result.scalars().all())
+        if len(objs) <= limit:
+            return objs, None
+        objs = objs[:limit]
+        return objs, (objs[-1].created_at, objs[-1].id)
+
+    async def get_many_by_uuid_list(self, Model: type[sa_BaseModel], uuid_list: list[pd.UUID4]) -> list[sa_BaseModel]:
+        """single select, raises 404 if any of uuids is not found"""
+        uuids = normalize_uuids(uuid_list)
+        result = await self.session.scalars(select(Model).where(in_array(Model.uuid, uuids)))
+        objs = {obj.uuid: obj for obj in result}
+        self._raise_if_missing(Model, uuids, objs)
+        return [objs[_uuid] for _uuid in uuids]
+
+    @staticmethod
+    def _raise_if_missing(Model: type[sa_BaseModel], uuids: list[str], found) -> None:
+        missing = [_uuid for _uuid in uuids if _uuid not in found]
+        if missing:
+            raise NotFoundException(f'Trying to get {Model} with uuids {missing}, which are not found.')
+
     async def get_or_create_many(
             self, Model: type[sa_BaseModel], serializers: list[pd.BaseModel]
     ) -> list[sa_BaseModel]:
@@ -149,13 +189,85 @@ class SqlAlchemyRepositoryAsync(AbstractRepositoryAsync):
             await self.session.rollback()
             raise ValueError(f'Error while removing {Model=:} {id=:}: {str(e)}')
 
+    async def update_many(self, objs: list[sa_BaseModel], serializer: pd.BaseModel | dict) -> list[sa_BaseModel]:
+        """single UPDATE ... WHERE id = ANY(...) for all objs (must be the same Model)"""
+        if not objs:
+            return objs
+        update_data = serializer if isinstance(serializer, dict) else serializer.model_dump(exclude_unset=True)
+        Model = type(objs[0])
+        update_data = {field: value for field, value in update_data.items() if hasattr(Model, field)}
+        try:
+            await self.session.execute(sa.update(Model).where(in_array(Model.id, [obj.id for obj in objs]))
+                                       .values(**update_data).execution_options(synchronize_session='fetch'))
+            await self.session.commit()
+        except IntegrityError as e:
+            await self.session.rollback()
+            raise ValueError(f'Error while updating {len(objs)} objs: {str(e)}')
+        return objs
+
+    async def update_many_by_uuid_list(self, Model: type[sa_BaseModel], uuid_list: list[pd.UUID4],
+                                       values: dict) -> list[sa_BaseModel]:
+        """single UPDATE ... WHERE uuid = ANY(...) RETURNING, if any of uuids isn't found nothing is updated
+        and 404 is raised, objs already loaded to session are not synchronized"""
+        uuids = normalize_uuids(uuid_list)
+        stmt = sa.update(Model).where(in_array(Model.uuid, uuids)).values(**values).returning(Model)
+        try:
+            result = await self.session.scalars(stmt, execution_options={'synchronize_session': False})
+            objs = {obj.uuid: obj for obj in result}
+            self._raise_if_missing(Model, uuids, objs)
+            await self.session.commit()
+        except IntegrityError as e:
+            await self.session.rollback()
+            raise ValueError(f'Error while updating {len(uuids)} {Model=:}: {str(e)}')
+        except NotFoundException:
+            await self.session.rollback()
+            raise
+        return [objs[_uuid] for _uuid in uuids]
+
+    async def remove_by_uuid(self, Model: type[sa_BaseModel], _uuid: pd.UUID4) -> None:
+        obj = await self.get(Model, uuid=str(_uuid))
+        if obj is None:
+            raise NotFoundException(f'Cant remove, {Model=:} uuid={_uuid} not found')
+        await self.session.delete(obj)
+        try:
+            await self.session.commit()
+        except IntegrityError as e:
+            await self.session.rollback()
+            raise ValueError(f'Error while removing {Model=:} uuid={_uuid}: {str(e)}')
+
+    async def remove_many_by_uuid_list(self, Model: type[sa_BaseModel], uuid_list: list[pd.UUID4]) -> list[str]:
+        """single DELETE ... WHERE uuid = ANY(...), not found uuids are skipped, returns removed uuids"""
+        uuids = normalize_uuids(uuid_list)
+        if not uuids:
+            return []
+        stmt = sa.delete(Model).where(in_array(Model.uuid, uuids)).returning(Model.uuid)
+        try:
+            removed = (await self.session.scalars(stmt, execution_options={'synchronize_session': False})).all()
+            await self.session.commit()
+        except IntegrityError as e:
+            await self.session.rollback()
+            raise ValueError(f'Error while removing {len(uuids)} {Model=:}: {str(e)}')
+        return removed
+
     async def get_or_create_duplicated_user(self,
-                                            current_user_uuid: pd.UUID4,
+                                            current_user_uuid: pd.UUID4 | str,
                                             current_user_email: pd.EmailStr) -> UserModel:
-        user = await self.get(UserModel, uuid=current_user_uuid)
-
-        if user is None:
-            user = await self.create(UserModel, UserCreateSerializer(uuid=current_user_uuid.hex, email=current_user_email))
-        elif user is not None and current_user_email != user.email:
-            user = await self.update(user, UserUpdateSerializer(email=current_user_email))
+        """single INSERT ... ON CONFLICT (uuid) DO UPDATE ... RETURNING, so concurrent first requests of the same
+        user don't race on unique uuid, existing row is written only if email was changed,
+        otherwise nothing is returned and it's selected"""
+        user_uuid = str(current_user_uuid)
+        stmt = pg_insert(UserModel).values(uuid=user_uuid, email=current_user_email)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[UserModel.uuid],
+            set_={'email': stmt.excluded.email, 'updated_at': sa.func.current_timestamp()},
+            where=UserModel.email.is_distinct_from(stmt.excluded.email),
+        ).returning(UserModel)
+        try:
+            user = (await self.session.scalars(stmt, execution_options={'populate_existing': True})).first()
+            if user is None:
+                user = await self.get(UserModel, uuid=user_uuid)
+            await self.session.commit()
+        except IntegrityError as e:
+            await self.session.rollback()
+            raise ValueError(f'Error while duplicating user {user_uuid=:} {current_user_email=:}: {str(e)}')
         return user
@@ -1,14 +1,18 @@
 import abc
+from collections.abc import Iterator
 from typing import Type
 
 import fastapi as fa
 import pydantic as pd
+import sqlalchemy as sa
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel as pd_Model
+from sqlalchemy.engine import Row
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.query import Query
 
 from db import Base as sa_Model
+from db.expressions import in_array, normalize_uuids
 from db.models.celery_tasks import IntervalScheduleModel, PeriodicTaskModel, CrontabScheduleModel
 from db.serializers.celery_tasks import (
     PeriodicTaskCreateSchedulesSerializer,
@@ -52,26 +56,25 @@ class SqlAlchemyRepositorySync(AbstractRepositorySync):
         return obj
 
     def get_many_by_id_list(self, Model: Type[sa_Model], id_list: list[int]) -> list[sa_Model]:
-        """getting objs one by one and if cant find any of them, raises 404"""
-        objs = []
-        for id in id_list:
-            obj = self.session.query(Model).get(id)
-            if obj is None:
-                raise fa.HTTPException(status_code=404,
-                                       detail=f"Trying to get {Model} with id {id}, which is not found.")
-            objs.append(obj)
-        return objs
+        """single select, if cant find any of them, raises 404"""
+        return self._get_many_by(Model, Model.id, list(id_list))
 
     def get_many_by_uuid_list(self, Model: Type[sa_Model], uuid_list: list[pd.UUID4]) -> list[sa_Model]:
-        """getting objs one by one and if cant find any of them, raises 404"""
-        objs = []
-        for _uuid in uuid_list:
-            obj = self.get(Model, uuid=_uuid.hex)
-            if obj is None:
-                raise fa.HTTPException(status_code=404,
-                                       detail=f"Trying to get {Model} with uuid {_uuid.hex}, which is not found.")
-            objs.append(obj)
-        return objs
+        """single select, if cant find any of them, raises 404"""
+        return self._get_many_by(Model, Model.uuid, normalize_uuids(uuid_list))
+
+    def _get_many_by(self, Model: Type[sa_Model], column: sa.Column, values: list) -> list[sa_Model]:
+        objs = {getattr(obj, column.key): obj
+                for obj in self.session.scalars(sa.select(Model).where(in_array(column, values)))}
+        self._raise_if_missing(Model, column, values, objs)
+        return [objs[value] for value in values]
+
+    @staticmethod
+    def _raise_if_missing(Model: Type[sa_Model], column: sa.Column, values: list, found) -> None:
+        missing = [value for value in values if value not in found]
+        if missing:
+            raise fa.HTTPException(status_code=404,
+                                   detail=f"Trying to get {Model} with {column.key} {missing}, which is not found.")
 
     def get_all(self, Model: Type[sa_Model]) -> list[sa_Model]:
         return self.session.query(Model).all()
@@ -82,6 +85,66 @@ class SqlAlchemyRepositorySync(AbstractRepositorySync):
     def get_all_inactive(self, Model: Type[sa_Model]) -> list[sa_Model]:
         return self.session.query(Model).filter(Model.is_active == False).all()
 
+    def get_chunks_by_id(self, Model: Type[sa_Model], chunk_size: int,
+                         id_from: int | None = None, id_to: int | None = None, **kwargs) -> Iterator[list[sa_Model]]:
+        """keyset pagination over Model.id (inclusive id_from/id_to bounds), yields lists of up to chunk_size objs,
+        objs are detached from session, so commits made while processing a chunk don't expire (and re-select) them"""
+        query = self.session.query(Model).filter_by(**kwargs)
+        if id_from is not None:
+            query = query.filter(Model.id >= id_from)
+        if id_to is not None:
+            query = query.filter(Model.id <= id_to)
+        last_id = None
+        while True:
+            chunk_query = query if last_id is None else query.filter(Model.id > last_id)
+            objs = chunk_query.order_by(Model.id).limit(chunk_size).all()
+            if not objs:
+                return
+            for obj in objs:
+                self.session.expunge(obj)
+            yield objs
+            last_id = objs[-1].id
+
+    def count_grouped_by(self, column: sa.Column, *criteria) -> dict:
+        """{column value: count of rows} for rows matching criteria"""
+        stmt = sa.select(column, sa.func.count()).select_from(column.table).where(*criteria).group_by(column)
+        return dict(self.session.execute(stmt).all())
+
+    def get_id_ranges(self, Model: Type[sa_Model], range_size: int) -> list[tuple[int, int]]:
+        """split table into consecutive (id_from, id_to) ranges of range_size rows each, by single select"""
+        numbered = sa.select(Model.id,
+                             ((sa.func.row_number().over(order_by=Model.id) - 1) // range_size).label('bucket')
+                             ).subquery()
+        stmt = (sa.select(sa.func.min(numbered.c.id), sa.func.max(numbered.c.id))
+                .group_by(numbered.c.bucket)
+                .order_by(sa.func.min(numbered.c.id)))
+        return [(id_from, id_to) for id_from, id_to in self.session.execute(stmt)]
+
+    def stream_id_ranges(self, stmt: sa.Select, range_size: int) -> Iterator[tuple[int, int]]:
+        """stmt selects single id column ordered by it, ids are streamed through server-side cursor range_size
+        at a time, yields (first, last) id of every range_size ids, memory use doesn't depend on number of rows"""
+        result = self.session.execute(stmt.execution_options(yield_per=range_size))
+        for ids in result.scalars().partitions():
+            yield ids[0], ids[-1]
+
+    def get_chunks_by_uuid_list(self, Model: Type[sa_Model], uuid_list: list[str],
+                                chunk_size: int) -> Iterator[list[sa_Model]]:
+        """one select per chunk of uuid_list, not found uuids are skipped, objs are detached (see get_chunks_by_id)"""
+        for i in range(0, len(uuid_list), chunk_size):
+            objs = self.session.query(Model).filter(in_array(Model.uuid, uuid_list[i:i + chunk_size])).all()
+            for obj in objs:
+                self.session.expunge(obj)
+            yield objs
+
+    def get_for_update_skip_locked(self, Model: Type[sa_Model], *criteria, limit: int,
+                                   order_by: tuple = (), options: tuple = ()) -> list[sa_Model]:
+        """SELECT ... FOR UPDATE SKIP LOCKED LIMIT n: claims up to 'limit' rows not locked by other transactions,
+        returned rows stay locked until session commit/rollback, only Model rows are locked
+        (so relationships may be joined eagerly with 'options')"""
+        stmt = (sa.select(Model).options(*options).where(*criteria).order_by(*order_by).limit(limit)
+                .with_for_update(skip_locked=True, of=Model))
+        return self.session.scalars(stmt).all()
+
     def get_query(self, Model: Type[sa_Model], **kwargs) -> Query:
         query = self.session.query(Model)
         for attr, value in kwargs.items():
@@ -127,6 +190,21 @@ class SqlAlchemyRepositorySync(AbstractRepositorySync):
                              detail=e.orig.diag.message_detail)
         return objs
 
+    def create_many_returning(self, Model: Type[sa_Model], serializers: list[pd_Model],
+                              *returning: sa.Column) -> list[Row]:
+        """single INSERT ... RETURNING for all serializers, returns rows of 'returning' columns (Model.id by default)"""
+        if not serializers:
+            return []
+        values = [jsonable_encoder(serializer) for serializer in serializers]
+        try:
+            rows = self.session.execute(sa.insert(Model).returning(*(returning or (Model.id,))), values).all()
+            self.session.commit()
+        except IntegrityError as e:
+            self.session.rollback()
+            raise fa.HTTPException(status_code=fa.status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                   detail=e.orig.diag.message_detail)
+        return rows
+
     def get_or_create_many(self, Model: Type[sa_Model], serializers: list[pd_Model]) -> list[sa_Model]:
         objs = []
         for serializer in serializers:
@@ -208,15 +286,15 @@ class SqlAlchemyRepositorySync(AbstractRepositorySync):
         return obj
 
     def update_many(self, objs: list[sa_Model], serializer: pd_Model | dict) -> list[sa_Model]:
-        # assert objects_are_the_same_type(objs), 'all objects must be the same type'
-        update_data = serializer if isinstance(serializer, dict) else serializer.dict(exclude_unset=True)
-
-        for obj in objs:
-            fields_to_update = [x for x in update_data if hasattr(obj, x)]
-            for field in fields_to_update:
-                setattr(obj, field, update_data[field])
-            self.session.add(obj)
+        """single UPDATE ... WHERE id = ANY(...) for all objs (must be the same Model)"""
+        if not objs:
+            return objs
+        update_data = serializer if isinstance(serializer, dict) else serializer.model_dump(exclude_unset=True)
+        Model = type(objs[0])
+        update_data = {field: value for field, value in update_data.items() if hasattr(Model, field)}
         try:
+            self.session.execute(sa.update(Model).where(in_array(Model.id, [obj.id for obj in objs]))
+                                 .values(**update_data).execution_options(synchronize_session='fetch'))
             self.session.commit()
         except IntegrityError as e:
             self.session.rollback()
@@ -225,6 +303,46 @@ class SqlAlchemyRepositorySync(AbstractRepositorySync):
 
         return objs
 
+    def update_many_by_uuid_list(self, Model: Type[sa_Model], uuid_list: list[pd.UUID4],
+                                 values: dict) -> list[sa_Model]:
+        """single UPDATE ... WHERE uuid = ANY(...) RETURNING, if any of uuids isn't found nothing is updated and 404
+        is raised, objs already loaded to session are not synchronized, returned objs are detached,
+        so reading them after commit doesn't re-select them"""
+        uuids = normalize_uuids(uuid_list)
+        stmt = sa.update(Model).where(in_array(Model.uuid, uuids)).values(**values).returning(Model)
+        try:
+            objs = {obj.uuid: obj
+                    for obj in self.session.scalars(stmt, execution_options={'synchronize_session': False})}
+            self._raise_if_missing(Model, Model.uuid, uuids, objs)
+            for obj in objs.values():
+                self.session.expunge(obj)
+            self.session.commit()
+        except IntegrityError as e:
+            self.session.rollback()
+            raise fa.HTTPException(status_code=fa.status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                   detail=e.orig.diag.message_detail)
+        except fa.HTTPException:
+            self.session.rollback()
+            raise
+        return [objs[_uuid] for _uuid in uuids]
+
+    def update_many_by_id_list(self, Model: Type[sa_Model], id_list: list[int], values: dict,
+                               commit: bool = True) -> None:
+        """single UPDATE ... WHERE id = ANY(...), objs already loaded to session are not synchronized,
+        values may be sql expressions, with commit=False update is left in the current transaction"""
+        if not id_list:
+            return
+        self.session.execute(sa.update(Model).where(in_array(Model.id, id_list)).values(**values)
+                             .execution_options(synchronize_session=False))
+        if not commit:
+            return
+        try:
+            self.session.commit()
+        except IntegrityError as e:
+            self.session.rollback()
+            raise fa.HTTPException(status_code=fa.status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                   detail=e.orig.diag.message_detail)
+
     def remove(self, Model: Type[sa_Model], id: int) -> None:
         obj = self.session.query(Model).get(id)
         if obj is None:
@@ -251,29 +369,26 @@ class SqlAlchemyRepositorySync(AbstractRepositorySync):
             raise fa.HTTPException(status_code=fa.status.HTTP_500_INTERNAL_SERVER_ERROR,
                                    detail=e.orig.diag.message_detail)
 
-    def remove_many_by_id_list(self, Model: Type[sa_Model], id_list: list[int]) -> None:
-        """remove objects if found them"""
-        objs = self.session.query(Model).filter(Model.id.in_(id_list)).all()
-        for obj in objs:
-            self.session.delete(obj)
-        try:
-            self.session.commit()
-        except IntegrityError as e:
-            self.session.rollback()
-            raise fa.HTTPException(status_code=fa.status.HTTP_500_INTERNAL_SERVER_ERROR,
-                                   detail=e.orig.diag.message_detail)
+    def remove_many_by_id_list(self, Model: Type[sa_Model], id_list: list[int]) -> list[int]:
+        """single DELETE ... WHERE id = ANY(...), not found ids are skipped, returns removed ids"""
+        return self._remove_many_by(Model, Model.id, list(id_list))
+
+    def remove_many_by_uuid_list(self, Model: Type[sa_Model], uuid_list: list[pd.UUID4]) -> list[str]:
+        """single DELETE ... WHERE uuid = ANY(...), not found uuids are skipped, returns removed uuids"""
+        return self._remove_many_by(Model, Model.uuid, normalize_uuids(uuid_list))
 
-    def remove_many_by_uuid_list(self, Model: Type[sa_Model], uuid_list: list[pd.UUID4]) -> None:
-        """remove objects if found them"""
-        objs = self.session.query(Model).filter(Model.uuid.in_([_uuid.hex for _uuid in uuid_list])).all()
-        for obj in objs:
-            self.session.delete(obj)
+    def _remove_many_by(self, Model: Type[sa_Model], column: sa.Column, values: list) -> list:
+        if not values:
+            return []
+        stmt = sa.delete(Model).where(in_array(column, values)).returning(column)
         try:
+            removed = self.session.scalars(stmt, execution_options={'synchronize_session': False}).all()
             self.session.commit()
         except IntegrityError as e:
             self.session.rollback()
             raise fa.HTTPException(status_code=fa.status.HTTP_500_INTERNAL_SERVER_ERROR,
                                    detail=e.orig.diag.message_detail)
+        return removed
 
     def create_periodic_task_with_schedule(
             self,
@@ -4,7 +4,8 @@ import re
 
 import pydantic as pd
 
-from core.enums import TaskPriorityEnum, PeriodEnum, NotificatorCeleryTasksEnum
+from core.config import CELERY_TASK_ROUTES
+from core.enums import TaskPriorityEnum, PeriodEnum, NotificatorCeleryTasksEnum, CeleryQueueEnum
 from core.exceptions import BadRequestException
 
 
@@ -93,7 +94,7 @@ class PeriodicTaskUpdateSerializer(pd.BaseModel):
     crontab_id: int | None = None
     args: str | None = '[]'
     kwargs: str | None = '{}'
-    queue: str | None = 'default'
+    queue: str | None = None
     priority: TaskPriorityEnum | None = TaskPriorityEnum.mass_message_for_all_users_task_priority
     description: str | None = ''
     enabled: bool | None = True
@@ -123,6 +124,9 @@ class PeriodicTaskUpdateSerializer(pd.BaseModel):
         # if updating for disable/enable - no any fields validation needed
         if self.task is None:
             return
+        # periodic task is sent to the queue its task is routed to by CELERY_TASK_ROUTES
+        if self.queue is None:
+            self.queue = CELERY_TASK_ROUTES.get(self.task.value, CeleryQueueEnum.default).value
 
         # if task is 'check pending messages' - no other fields validation needed
         if self.task == NotificatorCeleryTasksEnum.check_availability_and_notify_pending_messages_all_task:
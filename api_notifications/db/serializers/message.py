@@ -22,6 +22,7 @@ class MessageCreateSerializer(MessageUpdateSerializer):
     text: str
     is_notified: bool = False
     priority: MessagePriorityEnum = MessagePriorityEnum.mass_all_users
+    deliver_after: dt.datetime | None = None
 
     class Config:
         from_attributes = True
@@ -35,3 +36,8 @@ class MessageReadSerializer(MessageCreateSerializer):
 
     class Config:
         from_attributes = True
+
+
+class MessagePageSerializer(pd.BaseModel):
+    items: list[MessageReadSerializer]
+    next_cursor: str | None = None
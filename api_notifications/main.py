@@ -2,7 +2,7 @@ from contextlib import asynccontextmanager
 
 import fastapi as fa
 import uvicorn
-from fastapi.responses import ORJSONResponse
+from fastapi.responses import ORJSONResponse, Response
 
 from api.v1.auth import messages as v1_auth_messages
 from api.v1.auth import postgres as v1_auth_postgres
@@ -11,16 +11,31 @@ from api.v1.services import notifications as v1_services_notifications
 from api.v1.services import tasks as v1_services_tasks
 from api.v1.services import users as v1_services_users
 from core.config import settings
-from core.dependencies import verified_access_token_dependency, verify_service_secret_dependency
+from core.dependencies import (
+    auth_http_client,
+    verified_access_token_dependency,
+    verify_metrics_client_dependency,
+    verify_service_secret_dependency,
+)
+from core.metrics import generate_metrics
 from db import init_models
+from services.notificator.notificator import telegram_http_client
+from services.notificator.rate_limiter import rate_limit_redis
+from services.notificator.smtp_pool import smtp_pool
 
 
 @asynccontextmanager
 async def lifespan(app: fa.FastAPI):
     init_models()
     # startup
+    telegram_http_client.get()
+    auth_http_client.get()
     yield
     # shutdown
+    await auth_http_client.aclose()
+    await telegram_http_client.aclose()
+    await rate_limit_redis.aclose()
+    smtp_pool.close_all()
 
 
 app = fa.FastAPI(
@@ -49,5 +64,13 @@ v1_router_services.include_router(v1_services_users.router, prefix='/services-us
 app.include_router(v1_router_auth, prefix="/api/v1")
 app.include_router(v1_router_services, prefix="/api/v1")
 
+
+@app.get("/metrics", include_in_schema=False, dependencies=[fa.Depends(verify_metrics_client_dependency)])
+async def metrics():
+    """prometheus metrics of the api (of all its worker processes in multiprocess mode), db isn't queried,
+    pending backlog gauge is exported by celery workers"""
+    content, content_type = generate_metrics()
+    return Response(content=content, headers={"Content-Type": content_type})
+
 if __name__ == "__main__":
     uvicorn.run('main:app', host=settings.API_NOTIFICATIONS_HOST, port=settings.API_NOTIFICATIONS_PORT, reload=True)
@@ -0,0 +1,79 @@
+"""
+compares email delivery throughput of
+    - 'connection per email': new smtplib.SMTP session per message, sent one after another (previous implementation)
+    - 'pooled async': Notificator.send_email (pooled sessions offloaded to threads, bounded by EMAIL_MAX_CONCURRENCY)
+against local stand-in smtp server
+
+usage:
+    python3 -m scripts.benchmarks.email_transport -n 500 --latency-ms 20 --concurrency 4 8 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import smtplib
+import time
+from email.message import EmailMessage
+
+from scripts.benchmarks.fixtures import UNLIMITED_ENV
+from scripts.benchmarks.smtp_sink import SMTPSink
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--messages', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='smtp sink delay per message')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16])
+    return parser.parse_args()
+
+
+def bench_connection_per_email(host: str, port: int, messages: int) -> float:
+    start = time.perf_counter()
+    for i in range(messages):
+        msg = EmailMessage()
+        msg['Subject'] = 'benchmark'
+        msg['From'] = 'notifications@cinema.online'
+        msg['To'] = f'user{i}@cinema.online'
+        msg.set_content('benchmark message')
+        with smtplib.SMTP(host, port) as smtp:
+            smtp.send_message(msg)
+    return messages / (time.perf_counter() - start)
+
+
+async def bench_pooled_async(messages: int) -> float:
+    from services.notificator.notificator import Notificator, run_concurrently
+
+    notificator = Notificator(repo=None)
+    start = time.perf_counter()
+    await run_concurrently((notificator.send_email(f'user{i}@cinema.online', 'benchmark message')
+                            for i in range(messages)),
+                           limit=messages)
+    return messages / (time.perf_counter() - start)
+
+
+def main():
+    args = get_args()
+    sink = SMTPSink(latency=args.latency_ms / 1000).start()
+    # settings are read on import, so smtp sink and unlimited rate limiters must be set before importing notificator
+    os.environ.update({'SMTP_HOST': '127.0.0.1', 'SMTP_PORT': str(sink.port), **UNLIMITED_ENV})
+
+    results = {'messages': args.messages,
+               'latency_ms': args.latency_ms,
+               'connection_per_email_msg_per_sec': bench_connection_per_email('127.0.0.1', sink.port, args.messages),
+               'pooled_async_msg_per_sec': {}}
+    from core.config import settings
+    from services.notificator.smtp_pool import smtp_pool
+    for concurrency in args.concurrency:
+        settings.EMAIL_MAX_CONCURRENCY = concurrency
+        smtp_pool.close_all()
+        smtp_pool.size = concurrency
+        smtp_pool.reset()
+        results['pooled_async_msg_per_sec'][concurrency] = asyncio.run(bench_pooled_async(args.messages))
+        smtp_pool.close_all()
+
+    sink.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+benchmark data in notifications postgres of current env: users are seeded with 'bench-<run>-' emails
+and are removed with their messages by remove_seeded(), modules of api are imported lazily,
+so set_env() takes effect if it's called before the first seed
+"""
+import datetime as dt
+import os
+import uuid
+
+from scripts.benchmarks.smtp_sink import SMTPSink
+from scripts.benchmarks.telegram_sink import TelegramSink
+
+MSG_TEXT = 'benchmark message'
+SEED_CHUNK_SIZE = 1000
+
+
+# benchmarks measure notificator, not provider limits: in-process rate limiters that never throttle, no redis
+UNLIMITED_ENV = {
+    'RATE_LIMIT_REDIS': 'False',
+    'AUTH_USER_CACHE_REDIS': 'False',
+    'EMAIL_RATE_LIMIT': '1000000',
+    'EMAIL_RATE_BURST': '1000000',
+    'TELEGRAM_RATE_LIMIT': '1000000',
+    'TELEGRAM_RATE_BURST': '1000000',
+}
+
+
+def set_env(smtp_sink: SMTPSink, telegram_sink: TelegramSink) -> None:
+    """settings are read on import, so stand-ins and unlimited rate limiters must be set before importing notificator"""
+    os.environ.update({
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': str(smtp_sink.port),
+        'TG_API_URL': telegram_sink.url,
+        'TG_BOT_ID': 'botbenchmark',
+        **UNLIMITED_ENV,
+    })
+
+
+def seed_users(run_id: str, users: int) -> list:
+    """rows (id, uuid, email) of seeded users ordered by id, users accept all channels"""
+    from db import SessionLocal
+    from db.models.user import UserModel
+    from db.repository_sync import SqlAlchemyRepositorySync
+    from db.serializers.user import UserCreateSerializer
+
+    repo = SqlAlchemyRepositorySync(SessionLocal())
+    rows = []
+    for start in range(0, users, SEED_CHUNK_SIZE):
+        rows += repo.create_many_returning(
+            UserModel,
+            [UserCreateSerializer(uuid=str(uuid.uuid4()), email=f'bench-{run_id}-{i}@cinema.online', timezone='UTC+3',
+                                  is_accepting_emails=True, is_accepting_interface_messages=True,
+                                  is_accepting_telegram=True, telegram_id=str(i))
+             for i in range(start, min(users, start + SEED_CHUNK_SIZE))],
+            UserModel.id, UserModel.uuid, UserModel.email)
+    repo.session.close()
+    return sorted(rows, key=lambda row: row.id)
+
+
+def seed_messages(user_uuids: list[str], per_user: int = 1, deliver_after: dt.datetime | None = None) -> list:
+    """rows (id, uuid, to_user_uuid) of seeded messages of individual_pending priority:
+        -with deliver_after - pending, deliverable after it
+        -else already notified"""
+    from core.enums import MessagePriorityEnum
+    from db import SessionLocal
+    from db.models.message import MessageModel
+    from db.repository_sync import SqlAlchemyRepositorySync
+    from db.serializers.message import MessageCreateSerializer
+
+    repo = SqlAlchemyRepositorySync(SessionLocal())
+    to_user_uuids = [user_uuid for user_uuid in user_uuids for _ in range(per_user)]
+    rows = []
+    for start in range(0, len(to_user_uuids), SEED_CHUNK_SIZE):
+        rows += repo.create_many_returning(
+            MessageModel,
+            [MessageCreateSerializer(to_user_uuid=user_uuid, text=MSG_TEXT,
+                                     priority=MessagePriorityEnum.individual_pending,
+                                     is_notified=deliver_after is None, deliver_after=deliver_after)
+             for user_uuid in to_user_uuids[start:start + SEED_CHUNK_SIZE]],
+            MessageModel.id, MessageModel.uuid, MessageModel.to_user_uuid)
+    repo.session.close()
+    return rows
+
+
+def remove_seeded(user_uuids: list[str]) -> None:
+    import sqlalchemy as sa
+
+    from db import SessionLocal
+    from db.expressions import in_array
+    from db.models.message import MessageModel
+    from db.models.user import UserModel
+
+    session = SessionLocal()
+    for start in range(0, len(user_uuids), SEED_CHUNK_SIZE):
+        chunk = user_uuids[start:start + SEED_CHUNK_SIZE]
+        session.execute(sa.delete(MessageModel).where(in_array(MessageModel.to_user_uuid, chunk)))
+        session.execute(sa.delete(UserModel).where(in_array(UserModel.uuid, chunk)))
+    session.commit()
+    session.close()
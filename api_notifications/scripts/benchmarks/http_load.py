@@ -0,0 +1,190 @@
+"""
+load test of api endpoints: requests are sent to main:app in-process (httpx ASGI transport, no network and server,
+load generator shares the event loop with the app) by 'concurrency' clients, 'requests' per scenario
+    - auth service is stubbed: verified_access_token_dependency is overridden to return payload
+      of seeded user, whose index is the bearer token
+    - service endpoints are called with SERVICE_TO_SERVICE_SECRET
+    - send-* endpoints deliver to local stand-in smtp and telegram servers (as_celery_task=false,
+      broker isn't needed), mass messages go to 'mass-users' seeded users per request
+benchmark users and messages are seeded to notifications postgres of current env and are removed at the end
+
+usage:
+    DEBUG=True python3 -m scripts.benchmarks.http_load --requests 2000 --concurrency 1 16 64 \
+        --scenarios messages_to_me mark_read_many --output http_load.json
+"""
+import argparse
+import asyncio
+import datetime as dt
+import json
+import platform
+import random
+import time
+import uuid
+from collections import Counter
+
+from scripts.benchmarks.fixtures import MSG_TEXT, remove_seeded, seed_messages, seed_users, set_env
+from scripts.benchmarks.smtp_sink import SMTPSink
+from scripts.benchmarks.stats import summarize
+from scripts.benchmarks.telegram_sink import TelegramSink
+
+SCENARIOS = ('send_email', 'send_individual_immediate_message', 'send_individual_pending_message',
+             'send_mass_message_to_filtered_users', 'messages_to_me', 'mark_read_many', 'periodic_tasks')
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200, help='seeded users, requests are spread across them')
+    parser.add_argument('--messages-per-user', type=int, default=50)
+    parser.add_argument('--mass-users', type=int, default=20, help='addressees of one mass message request')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per scenario and concurrency')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--smtp-latency-ms', type=float, default=5.0)
+    parser.add_argument('--tg-latency-ms', type=float, default=20.0)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('-o', '--output', help='write json results to file as well')
+    return parser.parse_args()
+
+
+class LoadTest:
+    """builds request of scenario for seeded users and sends them with given concurrency"""
+
+    def __init__(self, client, args, users: list[str], messages: dict[str, list[str]]):
+        from core.config import settings
+        from core.enums import ServicesNamesEnum
+
+        self.client = client
+        self.args = args
+        self.users = users
+        self.messages = messages
+        self.service_headers = {'Authorization': settings.SERVICE_TO_SERVICE_SECRET,
+                                'Service-Name': ServicesNamesEnum.api_auth.value}
+
+    def user_headers(self, i: int) -> dict:
+        return {'Authorization': f'Bearer {i % len(self.users)}'}
+
+    def build_request(self, scenario: str, i: int) -> tuple[str, str, dict]:
+        """method, url and httpx request kwargs of i-th request of scenario"""
+        user_uuid = self.users[i % len(self.users)]
+        service = '/api/v1/services-notifications'
+        if scenario == 'send_email':
+            return 'POST', f'{service}/send-email', {
+                'headers': self.service_headers,
+                'json': {'email_to': f'bench-{i}@cinema.online', 'msg_text': MSG_TEXT}}
+        if scenario in ('send_individual_immediate_message', 'send_individual_pending_message'):
+            return 'POST', f'{service}/{scenario.replace("_", "-")}', {
+                'headers': self.service_headers,
+                'json': {'user_uuid': user_uuid, 'msg_text': MSG_TEXT}}
+        if scenario == 'send_mass_message_to_filtered_users':
+            return 'POST', f'{service}/send-mass-message-to-filtered-users', {
+                'headers': self.service_headers,
+                'params': {'as_celery_task': False},
+                'json': {'user_uuid_list': random.sample(self.users, min(self.args.mass_users, len(self.users))),
+                         'msg_text': MSG_TEXT}}
+        if scenario == 'messages_to_me':
+            return 'GET', '/api/v1/messages/to-me', {'headers': self.user_headers(i)}
+        if scenario == 'mark_read_many':
+            return 'PUT', '/api/v1/messages/mark-read-many', {
+                'headers': self.user_headers(i),
+                'json': self.messages[user_uuid][:10]}
+        if scenario == 'periodic_tasks':
+            return 'GET', '/api/v1/services-tasks/periodic-tasks', {'headers': self.service_headers}
+        raise ValueError(f'unknown scenario {scenario!r}')
+
+    async def run(self, scenario: str, requests: int, concurrency: int) -> dict:
+        latencies = []
+        statuses = Counter()
+        errors = 0
+        counter = iter(range(requests))
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                method, url, kwargs = self.build_request(scenario, i)
+                start = time.perf_counter()
+                try:
+                    resp = await self.client.request(method, url, **kwargs)
+                except Exception as e:
+                    statuses[type(e).__name__] += 1
+                    errors += 1
+                    continue
+                statuses[resp.status_code] += 1
+                if resp.status_code >= 400:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return {**summarize(latencies, time.perf_counter() - start, errors),
+                'statuses': {str(status): count for status, count in statuses.items()}}
+
+
+def override_auth(app, users: list) -> None:
+    """verified token of seeded user users[int(bearer token)], auth service isn't called"""
+    import fastapi as fa
+
+    from core.dependencies import verified_access_token_dependency
+    from core.exceptions import UnauthorizedException
+
+    async def stub_verified_access_token(request: fa.Request) -> dict:
+        try:
+            user = users[int(request.headers['Authorization'].split()[-1])]
+        except (KeyError, ValueError, IndexError):
+            raise UnauthorizedException
+        return {'sub': user.uuid, 'email': user.email}
+
+    app.dependency_overrides[verified_access_token_dependency] = stub_verified_access_token
+
+
+async def run_load(args, users: list, messages: dict[str, list[str]]) -> dict:
+    import httpx
+
+    from main import app, lifespan
+
+    override_auth(app, users)
+    results = {}
+    async with lifespan(app):
+        async with httpx.AsyncClient(app=app, base_url='http://api_notifications', timeout=60) as client:
+            load_test = LoadTest(client, args, [user.uuid for user in users], messages)
+            for scenario in args.scenarios:
+                results[scenario] = {}
+                for concurrency in args.concurrency:
+                    results[scenario][concurrency] = await load_test.run(scenario, args.requests, concurrency)
+    return results
+
+
+def main():
+    args = get_args()
+    smtp_sink = SMTPSink(latency=args.smtp_latency_ms / 1000).start()
+    telegram_sink = TelegramSink(latency=args.tg_latency_ms / 1000).start()
+    set_env(smtp_sink, telegram_sink)
+
+    from core import config
+
+    config.USER_NOTIFICATION_AVAILABLE_HOURS = list(range(24))
+    run_id = uuid.uuid4().hex[:8]
+    users = seed_users(run_id, args.users)
+    user_uuids = [user.uuid for user in users]
+    results = {'run_id': run_id,
+               'started_at': dt.datetime.utcnow().isoformat(),
+               'python': platform.python_version(),
+               'params': vars(args)}
+    try:
+        messages = {}
+        for row in seed_messages(user_uuids, args.messages_per_user):
+            messages.setdefault(row.to_user_uuid, []).append(row.uuid)
+        results['scenarios'] = asyncio.run(run_load(args, users, messages))
+    finally:
+        remove_seeded(user_uuids)
+        smtp_sink.stop()
+        telegram_sink.stop()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
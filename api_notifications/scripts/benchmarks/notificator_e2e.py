@@ -0,0 +1,153 @@
+"""
+end-to-end benchmark of notificator hot paths against local stand-in smtp and telegram servers
+and notifications postgres of current env (DEBUG=True - .envs/.local), benchmark users are seeded
+with 'bench-<run>-' emails in one id range and are removed with their messages at the end:
+    - individual_immediate / individual_pending: latency of every call, 'concurrency' calls in flight
+    - mass_filtered_users / mass_all_users (limited to seeded id range): one mass send to all seeded users
+    - pending_dispatch: dispatch_pending_messages_task over 'pending-per-user' seeded pending messages per user
+      (set PENDING_DIGEST=True to measure digests)
+latency of mass sends and dispatch is time from the start of the send to arrival of every email at the smtp sink,
+all users are made available at any hour, so every message is delivered immediately;
+message text has no placeholders, auth_postgres is not used
+
+usage:
+    DEBUG=True python3 -m scripts.benchmarks.notificator_e2e --users 1000 --smtp-latency-ms 5 --tg-latency-ms 20 \
+        --output benchmark.json
+"""
+import argparse
+import datetime as dt
+import json
+import platform
+import time
+import uuid
+
+from scripts.benchmarks.fixtures import MSG_TEXT, remove_seeded, seed_messages, seed_users, set_env
+from scripts.benchmarks.smtp_sink import SMTPSink
+from scripts.benchmarks.stats import summarize
+from scripts.benchmarks.telegram_sink import TelegramSink
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000, help='seeded users, each mass send goes to all of them')
+    parser.add_argument('--individual', type=int, default=200, help='calls of each individual scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='individual calls in flight')
+    parser.add_argument('--pending-per-user', type=int, default=1, help='pending messages per user to dispatch')
+    parser.add_argument('--smtp-latency-ms', type=float, default=5.0)
+    parser.add_argument('--tg-latency-ms', type=float, default=20.0)
+    parser.add_argument('--scenarios', nargs='+', default=['individual_immediate', 'individual_pending',
+                                                           'mass_filtered_users', 'mass_all_users',
+                                                           'pending_dispatch'])
+    parser.add_argument('-o', '--output', help='write json results to file as well')
+    return parser.parse_args()
+
+
+def arrival_latencies(sink, start: float) -> list[float]:
+    return [arrival - start for arrival in sink.arrivals]
+
+
+async def bench_individual(method_name: str, user_uuids: list[str], calls: int, concurrency: int) -> dict:
+    """'calls' calls of Notificator.<method_name>, each one with own session like celery task has"""
+    from db import SessionLocal
+    from db.repository_sync import SqlAlchemyRepositorySync
+    from services.notificator.notificator import Notificator, run_concurrently
+
+    latencies = []
+    errors = 0
+
+    async def call(user_uuid: str):
+        nonlocal errors
+        repo = SqlAlchemyRepositorySync(SessionLocal())
+        start = time.perf_counter()
+        try:
+            await getattr(Notificator(repo), method_name)(user_uuid, MSG_TEXT)
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors += 1
+        finally:
+            repo.session.close()
+
+    start = time.perf_counter()
+    await run_concurrently((call(user_uuids[i % len(user_uuids)]) for i in range(calls)), limit=concurrency)
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def run_scenario(name: str, args, users: list, smtp_sink: SMTPSink,
+                 telegram_sink: TelegramSink) -> dict:
+    from core.enums import MessagePriorityEnum
+    from db import SessionLocal
+    from db.repository_sync import SqlAlchemyRepositorySync
+    from services.notificator.celery_tasks import dispatch_pending_messages_task, run_notificator_coroutine
+    from services.notificator.notificator import Notificator
+
+    user_uuids = [user.uuid for user in users]
+    if name in ('individual_immediate', 'individual_pending'):
+        method_name = f'send_{name}_message'
+        result = run_notificator_coroutine(
+            bench_individual(method_name, user_uuids, args.individual, args.concurrency))
+        return {**result, 'emails': smtp_sink.received, 'telegrams': telegram_sink.received}
+
+    report = None
+    if name == 'pending_dispatch':
+        rows = seed_messages(user_uuids, args.pending_per_user, deliver_after=dt.datetime.utcnow())
+        message_ids = [row.id for row in rows]
+        id_from, id_to = min(message_ids), max(message_ids)
+        smtp_sink.reset()
+        telegram_sink.reset()
+        start = time.perf_counter()
+        report = dispatch_pending_messages_task(int(MessagePriorityEnum.individual_pending), id_from, id_to)
+    else:
+        repo = SqlAlchemyRepositorySync(SessionLocal())
+        notificator = Notificator(repo)
+        start = time.perf_counter()
+        if name == 'mass_filtered_users':
+            coro = notificator.send_mass_message_to_user_uuid_list(user_uuids, MSG_TEXT)
+        elif name == 'mass_all_users':
+            coro = notificator.send_mass_message_to_all_users(MSG_TEXT, users[0].id, users[-1].id)
+        else:
+            raise ValueError(f'unknown scenario {name!r}')
+        report = run_notificator_coroutine(coro).as_dict()
+        repo.session.close()
+    duration = time.perf_counter() - start
+    result = summarize(arrival_latencies(smtp_sink, start), duration)
+    return {**result, 'users_per_sec': round(len(users) / duration, 1),
+            'emails': smtp_sink.received, 'telegrams': telegram_sink.received, 'report': report}
+
+
+def main():
+    args = get_args()
+    smtp_sink = SMTPSink(latency=args.smtp_latency_ms / 1000).start()
+    telegram_sink = TelegramSink(latency=args.tg_latency_ms / 1000).start()
+    set_env(smtp_sink, telegram_sink)
+
+    from core import config
+    from services.notificator.smtp_pool import smtp_pool
+
+    config.USER_NOTIFICATION_AVAILABLE_HOURS = list(range(24))
+    run_id = uuid.uuid4().hex[:8]
+    users = seed_users(run_id, args.users)
+    results = {'run_id': run_id,
+               'started_at': dt.datetime.utcnow().isoformat(),
+               'python': platform.python_version(),
+               'params': vars(args),
+               'scenarios': {}}
+    try:
+        for name in args.scenarios:
+            smtp_sink.reset()
+            telegram_sink.reset()
+            results['scenarios'][name] = run_scenario(name, args, users, smtp_sink, telegram_sink)
+    finally:
+        remove_seeded([user.uuid for user in users])
+        smtp_pool.close_all()
+        smtp_sink.stop()
+        telegram_sink.stop()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
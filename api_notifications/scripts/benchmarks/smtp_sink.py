@@ -0,0 +1,74 @@
+import socketserver
+import threading
+import time
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """speaks just enough smtp for smtplib: accepts every message and drops it"""
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.reply('220 smtp-sink ready')
+        recipients = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self.reply('250 smtp-sink')
+            elif command in (b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                if command == b'RCPT':
+                    recipients += 1
+                elif command != b'NOOP':
+                    recipients = 0
+                self.reply('250 OK')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                with self.server.lock:
+                    self.server.received += recipients
+                    self.server.arrivals.extend([time.perf_counter()] * recipients)
+                recipients = 0
+                self.reply('250 OK: queued')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """local stand-in smtp server, 'latency' (seconds) is added to every DATA command to mimic a real relay,
+    'received' and 'arrivals' (time.perf_counter()) count every recipient of accepted messages"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        super().__init__((host, port), SMTPSinkHandler)
+        self.latency = latency
+        self.received = 0
+        self.arrivals: list[float] = []
+        self.lock = threading.Lock()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def reset(self) -> None:
+        with self.lock:
+            self.received = 0
+            self.arrivals = []
+
+    def start(self) -> 'SMTPSink':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
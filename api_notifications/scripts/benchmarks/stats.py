@@ -0,0 +1,25 @@
+import statistics
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: list[float], duration: float, errors: int = 0) -> dict:
+    """throughput and latency percentiles (ms) of operations finished in 'duration' seconds"""
+    values = sorted(latencies)
+    count = len(values) + errors
+    return {'count': count,
+            'errors': errors,
+            'error_rate': round(errors / count, 4) if count else 0.0,
+            'duration_s': round(duration, 3),
+            'per_sec': round(count / duration, 1) if duration else 0.0,
+            'mean_ms': round(statistics.fmean(values) * 1000, 2) if values else 0.0,
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p90_ms': round(percentile(values, 90) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2) if values else 0.0}
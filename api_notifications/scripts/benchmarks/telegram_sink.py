@@ -0,0 +1,67 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class TelegramSinkHandler(BaseHTTPRequestHandler):
+    """answers every POST /<bot_id>/sendMessage like telegram bot api does and drops the message"""
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.endswith('/sendMessage'):
+            self.reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.received += 1
+            self.server.arrivals.append(time.perf_counter())
+        self.reply(200, {'ok': True, 'result': {'message_id': self.server.received}})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TelegramSink(ThreadingHTTPServer):
+    """local stand-in of telegram bot api, 'latency' (seconds) is added to every sendMessage,
+    'arrivals' - time.perf_counter() of every accepted message"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        super().__init__((host, port), TelegramSinkHandler)
+        self.latency = latency
+        self.received = 0
+        self.arrivals: list[float] = []
+        self.lock = threading.Lock()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.server_address[0]}:{self.port}'
+
+    def reset(self) -> None:
+        with self.lock:
+            self.received = 0
+            self.arrivals = []
+
+    def start(self) -> 'TelegramSink':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
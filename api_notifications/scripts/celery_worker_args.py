@@ -0,0 +1,24 @@
+import sys
+
+from core.config import settings
+from core.enums import CeleryQueueEnum
+
+
+def get_celery_worker_args(worker_name: str) -> list[str]:
+    """celery worker cli options of worker from settings.CELERY_WORKERS,
+    'all' (single worker for local development) consumes all queues with celery default pool"""
+    if worker_name == 'all':
+        return [f'--queues={",".join(queue.value for queue in CeleryQueueEnum)}']
+    worker = settings.CELERY_WORKERS.get(worker_name)
+    if worker is None:
+        raise ValueError(f'unknown celery worker {worker_name!r}, available: {["all", *settings.CELERY_WORKERS]}')
+    args = [f'--queues={",".join(worker["queues"])}', f'--hostname={worker_name}@%h']
+    if worker.get('pool'):
+        args.append(f'--pool={worker["pool"]}')
+    if worker.get('concurrency'):
+        args.append(f'--concurrency={worker["concurrency"]}')
+    return args
+
+
+if __name__ == '__main__':
+    print(' '.join(get_celery_worker_args(sys.argv[1] if len(sys.argv) > 1 else 'all')))
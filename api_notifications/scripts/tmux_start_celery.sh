@@ -8,7 +8,7 @@ tmux new-session -d -s $session
 
 tmux send-keys "cd .." C-m
 tmux send-keys "export DEBUG=True" C-m
-tmux send-keys "celery -A celery_app worker --loglevel=info --queues=default" C-m
+tmux send-keys "celery -A celery_app worker --loglevel=info --queues=immediate,email,pending,mass,default" C-m
 
 tmux splitw -h
 
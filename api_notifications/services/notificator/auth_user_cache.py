@@ -0,0 +1,93 @@
+import json
+
+import redis
+
+from core.cache import TTLCache
+from core.config import settings
+from db.expressions import normalize_uuids
+from services.notificator.logger_config import logger
+
+
+class AuthUserDataCache:
+    """read-through cache of auth_postgres user data (placeholder values) by user uuid:
+        - in-process lru with short ttl (repeated renders for the same user never leave the worker)
+        - optionally redis shared by all workers, with longer ttl
+    invalidation removes user from redis and from cache of current process,
+    other processes may serve stale data at most AUTH_USER_CACHE_TTL seconds,
+    uuids are normalized to hyphenated form, so callers passing uuid.UUID, hex or hyphenated strings agree on keys"""
+
+    redis_key_prefix = 'notifications:auth_user:'
+
+    def __init__(self, maxsize: int, ttl: float, redis_client: redis.Redis | None = None, redis_ttl: int = 0):
+        self.local = TTLCache(maxsize, ttl)
+        self.redis = redis_client
+        self.redis_ttl = redis_ttl
+        self.redis_hits = 0
+        self.redis_misses = 0
+
+    def get_many(self, user_uuid_list: list[str]) -> tuple[dict[str, dict], list[str]]:
+        """returns found {user_uuid: user_data} and list of not cached uuids, both with normalized uuids"""
+        found = {}
+        missing = []
+        for user_uuid in normalize_uuids(user_uuid_list):
+            user_data = self.local.get(user_uuid)
+            if user_data is None:
+                missing.append(user_uuid)
+            else:
+                found[user_uuid] = user_data
+        if missing and self.redis is not None:
+            try:
+                values = self.redis.mget([f'{self.redis_key_prefix}{user_uuid}' for user_uuid in missing])
+            except redis.RedisError as e:
+                logger.error(f'auth user cache: redis get failed: {e}')
+                return found, missing
+            still_missing = []
+            for user_uuid, value in zip(missing, values):
+                if value is None:
+                    still_missing.append(user_uuid)
+                else:
+                    found[user_uuid] = json.loads(value)
+                    self.local.set(user_uuid, found[user_uuid])
+            self.redis_hits += len(missing) - len(still_missing)
+            self.redis_misses += len(still_missing)
+            missing = still_missing
+        return found, missing
+
+    def set_many(self, users_data: dict[str, dict]) -> None:
+        users_data = dict(zip(normalize_uuids(users_data), users_data.values()))
+        for user_uuid, user_data in users_data.items():
+            self.local.set(user_uuid, user_data)
+        if users_data and self.redis is not None:
+            try:
+                with self.redis.pipeline(transaction=False) as pipe:
+                    for user_uuid, user_data in users_data.items():
+                        pipe.set(f'{self.redis_key_prefix}{user_uuid}', json.dumps(user_data), ex=self.redis_ttl)
+                    pipe.execute()
+            except redis.RedisError as e:
+                logger.error(f'auth user cache: redis set failed: {e}')
+
+    def invalidate(self, user_uuid_list: list[str]) -> None:
+        user_uuid_list = normalize_uuids(user_uuid_list)
+        for user_uuid in user_uuid_list:
+            self.local.invalidate(user_uuid)
+        if user_uuid_list and self.redis is not None:
+            try:
+                self.redis.delete(*[f'{self.redis_key_prefix}{user_uuid}' for user_uuid in user_uuid_list])
+            except redis.RedisError as e:
+                logger.error(f'auth user cache: redis invalidate failed: {e}')
+
+    def clear(self) -> None:
+        self.local.clear()
+
+    def stats(self) -> dict:
+        return {'local': self.local.stats(),
+                'redis': None if self.redis is None else {'hits': self.redis_hits, 'misses': self.redis_misses}}
+
+
+auth_user_data_cache = AuthUserDataCache(
+    settings.AUTH_USER_CACHE_SIZE,
+    settings.AUTH_USER_CACHE_TTL,
+    redis_client=(redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT)
+                  if settings.AUTH_USER_CACHE_REDIS else None),
+    redis_ttl=settings.AUTH_USER_CACHE_REDIS_TTL,
+)
@@ -1,12 +1,60 @@
 import asyncio
+import datetime as dt
+import os
+
+import sqlalchemy as sa
+from celery import chord
+from celery.signals import worker_process_shutdown, worker_shutdown
 
 from celery_app import celery_app
-from core.enums import MessagePriorityEnum, TaskPriorityEnum
+from core.config import settings
+from core.enums import MessagePriorityEnum, NotificationChannelEnum, TaskPriorityEnum
+from core.metrics import PENDING_MESSAGES, observe_delivery
+from core.event_loop import BackgroundEventLoop
 from db import SessionLocal
 from db.models.message import MessageModel
+from db.models.user import UserModel
 from db.repository_sync import SqlAlchemyRepositorySync
+from services.notificator.delivery_report import DeliveryReport
 from services.notificator.logger_config import logger
-from services.notificator.notificator import Notificator
+from services.notificator.notificator import Notificator, telegram_http_client
+from services.notificator.rate_limiter import rate_limit_redis
+from services.notificator.smtp_pool import smtp_pool
+
+
+notificator_loop = BackgroundEventLoop('notificator')
+os.register_at_fork(after_in_child=notificator_loop.reset)
+
+
+async def close_loop_clients():
+    """clients bound to the current event loop"""
+    await telegram_http_client.aclose()
+    await rate_limit_redis.aclose()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_notificator_connections(**kwargs):
+    notificator_loop.stop(cleanup=close_loop_clients)
+    smtp_pool.close_all()
+
+
+def run_notificator_coroutine(coro):
+    """run coroutine to the end and return its result:
+        -with NOTIFICATOR_PERSISTENT_LOOP - in the long-lived loop of worker process, clients opened in it
+        are reused by next tasks, and with threads pool (celery worker --pool=threads --concurrency=N)
+        coroutines of N tasks are in flight in the same loop at once
+        -else in a fresh event loop, http and redis clients opened in it are closed before the loop is gone"""
+    if settings.NOTIFICATOR_PERSISTENT_LOOP:
+        return notificator_loop.run(coro)
+
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await close_loop_clients()
+
+    return asyncio.run(runner())
 
 
 # PRIORITY 1
@@ -14,7 +62,8 @@ from services.notificator.notificator import Notificator
 def send_email_task(email_to, msg_text):
     logger.debug('send_email_task started')
     notificator = Notificator(repo=None)  # as far as repo not needed for just sending email...
-    asyncio.run(notificator.send_email(email_to=email_to, msg_text=msg_text))
+    status = run_notificator_coroutine(notificator.send_email(email_to=email_to, msg_text=msg_text))
+    observe_delivery(NotificationChannelEnum.email, status)
 
 
 # PRIORITY 2
@@ -23,8 +72,9 @@ def send_individual_immediate_message_task(user_uuid: str, msg_text: str):
     logger.debug(f'send_individual_immediate_message_task started: {user_uuid=:}')
     repo = SqlAlchemyRepositorySync(SessionLocal())
     notificator = Notificator(repo)
-    asyncio.run(notificator.send_individual_immediate_message(user_uuid, msg_text))
+    delivery = run_notificator_coroutine(notificator.send_individual_immediate_message(user_uuid, msg_text))
     repo.session.close()
+    return delivery
 
 
 # PRIORITY 3
@@ -33,68 +83,137 @@ def send_individual_pending_message_task(user_uuid: str, msg_text: str):
     logger.debug('send_individual_pending_message_task started')
     repo = SqlAlchemyRepositorySync(SessionLocal())
     notificator = Notificator(repo)
-    asyncio.run(notificator.send_individual_pending_message(user_uuid, msg_text))
+    run_notificator_coroutine(notificator.send_individual_pending_message(user_uuid, msg_text))
     repo.session.close()
 
 
 # PRIORITY 4
 @celery_app.task(name='check_availability_and_notify_pending_messages_by_uuid_list_task')
 def check_availability_and_notify_pending_messages_by_uuid_list_task(message_uuid_list):
-    logger.debug(f'check_availability_and_notify_pending_messages_by_uuid_list_task started: {message_uuid_list=:}')
+    logger.debug(f'check_availability_and_notify_pending_messages_by_uuid_list_task started: {len(message_uuid_list)}')
     repo = SqlAlchemyRepositorySync(SessionLocal())
     notificator = Notificator(repo)
-    asyncio.run(notificator.check_availability_and_notify_pending_messages_by_uuid_list(message_uuid_list))
+    report = run_notificator_coroutine(
+        notificator.check_availability_and_notify_pending_messages_by_uuid_list(message_uuid_list))
     repo.session.close()
+    return report.as_dict()
+
+
+@celery_app.task(name='dispatch_pending_messages_task')
+def dispatch_pending_messages_task(message_priority: int, id_from: int | None = None, id_to: int | None = None):
+    """claim and deliver deliverable pending messages of message_priority (with id_from <= id <= id_to)
+    until none left, tasks may overlap (rows are claimed with FOR UPDATE SKIP LOCKED)"""
+    logger.debug(f'dispatch_pending_messages_task started: {message_priority=:} {id_from=:} {id_to=:}')
+    criteria = [MessageModel.priority == message_priority]
+    if id_from is not None:
+        criteria.append(MessageModel.id >= id_from)
+    if id_to is not None:
+        criteria.append(MessageModel.id <= id_to)
+    repo = SqlAlchemyRepositorySync(SessionLocal())
+    notificator = Notificator(repo)
+    report = run_notificator_coroutine(notificator.dispatch_pending_messages(*criteria))
+    repo.session.close()
+    return report.as_dict()
 
 
 @celery_app.task(name='check_availability_and_notify_pending_messages_all_task')
 def check_availability_and_notify_pending_messages_all_task():
+    """stream ids of deliverable pending messages (deliver_after <= now) through server-side cursor and start
+    dispatcher per id range of PENDING_DISPATCH_RANGE_SIZE messages, so neither memory of this task
+    nor size of task messages depends on the backlog; PENDING_MESSAGES gauge is set from the same run"""
     logger.debug('check_availability_and_notify_pending_messages_all_task started')
     repo = SqlAlchemyRepositorySync(SessionLocal())
-
-    message_individual_pending = repo.get_query(MessageModel,
-                                                is_notified=False,
-                                                priority=MessagePriorityEnum.individual_pending).all()
-    messages_mass_filtered_users = repo.get_query(MessageModel,
-                                                  is_notified=False,
-                                                  priority=MessagePriorityEnum.mass_filtered_users).all()
-    messages_mass_all_users = repo.get_query(MessageModel,
-                                             is_notified=False,
-                                             priority=MessagePriorityEnum.mass_all_users).all()
-
-    if message_individual_pending:
-        check_availability_and_notify_pending_messages_by_uuid_list_task.apply_async(
-            args=([message.uuid for message in message_individual_pending],),
-            priority=TaskPriorityEnum.individual_pending_message_task_priority,
-            queue='default')
-    if messages_mass_filtered_users:
-        check_availability_and_notify_pending_messages_by_uuid_list_task.apply_async(
-            args=([message.uuid for message in messages_mass_filtered_users],),
-            priority=TaskPriorityEnum.mass_message_for_filtered_users_task_priority,
-            queue='default')
-    if messages_mass_all_users:
-        check_availability_and_notify_pending_messages_by_uuid_list_task.apply_async(
-            args=([message.uuid for message in messages_mass_all_users],),
-            priority=TaskPriorityEnum.mass_message_for_all_users_task_priority,
-            queue='default')
+    now = dt.datetime.utcnow()
+    for message_priority, task_priority in (
+            (MessagePriorityEnum.individual_pending, TaskPriorityEnum.individual_pending_message_task_priority),
+            (MessagePriorityEnum.mass_filtered_users, TaskPriorityEnum.mass_message_for_filtered_users_task_priority),
+            (MessagePriorityEnum.mass_all_users, TaskPriorityEnum.mass_message_for_all_users_task_priority),
+    ):
+        stmt = (sa.select(MessageModel.id)
+                .where(MessageModel.is_notified == False,
+                       MessageModel.deliver_after <= now,
+                       MessageModel.priority == message_priority)
+                .order_by(MessageModel.id))
+        ranges = 0
+        for id_from, id_to in repo.stream_id_ranges(stmt, settings.PENDING_DISPATCH_RANGE_SIZE):
+            dispatch_pending_messages_task.apply_async(
+                args=(int(message_priority), id_from, id_to),
+                priority=task_priority)
+            ranges += 1
+        logger.info(f'check_availability_and_notify_pending_messages_all_task: {message_priority=:} {ranges=:}')
+    pending = repo.count_grouped_by(MessageModel.priority,
+                                    MessageModel.is_notified == False,
+                                    MessageModel.deliver_after.is_not(None))
+    for priority in MessagePriorityEnum:
+        PENDING_MESSAGES.labels(priority.name).set(pending.get(priority.value, 0))
     repo.session.close()
 
 
+@celery_app.task(name='aggregate_mass_message_reports_task')
+def aggregate_mass_message_reports_task(reports: list[dict], task_name: str):
+    """chord callback: merge reports of all shards of mass message task"""
+    report = DeliveryReport()
+    for shard_report in reports:
+        report.merge(DeliveryReport.from_dict(shard_report))
+    logger.info(f'{task_name} finished, {len(reports)} shards: {report}')
+    return report.as_dict()
+
+
 # PRIORITY 5
 @celery_app.task(name='send_mass_message_to_filtered_users_task')
 def send_mass_message_to_filtered_users_task(user_uuid_list: list[str], msg_text: str):
+    """split user_uuid_list to shards of MASS_MESSAGE_SHARD_SIZE, each shard is sent by separate task,
+    so shards are spread across all workers"""
     logger.debug('send_mass_message_for_filtered_users_task started')
+    shard_size = settings.MASS_MESSAGE_SHARD_SIZE
+    shards = [send_mass_message_to_filtered_users_shard_task.signature(
+        args=(user_uuid_list[i:i + shard_size], msg_text),
+        priority=TaskPriorityEnum.mass_message_for_filtered_users_task_priority)
+        for i in range(0, len(user_uuid_list), shard_size)]
+    if not shards:
+        return DeliveryReport().as_dict()
+    result = chord(shards)(aggregate_mass_message_reports_task.signature(
+        args=('send_mass_message_to_filtered_users_task',),
+        priority=TaskPriorityEnum.mass_message_for_filtered_users_task_priority))
+    return {'shards': len(shards), 'report_task_id': f'{result.id}'}
+
+
+@celery_app.task(name='send_mass_message_to_filtered_users_shard_task')
+def send_mass_message_to_filtered_users_shard_task(user_uuid_list: list[str], msg_text: str):
+    logger.debug(f'send_mass_message_to_filtered_users_shard_task started: {len(user_uuid_list)} users')
     repo = SqlAlchemyRepositorySync(SessionLocal())
     notificator = Notificator(repo)
-    asyncio.run(notificator.send_mass_message_to_user_uuid_list(user_uuid_list, msg_text))
+    report = run_notificator_coroutine(notificator.send_mass_message_to_user_uuid_list(user_uuid_list, msg_text))
     repo.session.close()
+    return report.as_dict()
 
 
 # PRIORITY 6
 @celery_app.task(name='send_mass_message_to_all_users_task')
 def send_mass_message_to_all_users_task(msg_text: str):
+    """split users table to id ranges of MASS_MESSAGE_SHARD_SIZE users, each range is sent by separate task,
+    so ranges are spread across all workers"""
     logger.debug('send_mass_message_to_all_users_task started')
     repo = SqlAlchemyRepositorySync(SessionLocal())
+    id_ranges = repo.get_id_ranges(UserModel, settings.MASS_MESSAGE_SHARD_SIZE)
+    repo.session.close()
+    shards = [send_mass_message_to_all_users_shard_task.signature(
+        args=(msg_text, id_from, id_to),
+        priority=TaskPriorityEnum.mass_message_for_all_users_task_priority)
+        for id_from, id_to in id_ranges]
+    if not shards:
+        return DeliveryReport().as_dict()
+    result = chord(shards)(aggregate_mass_message_reports_task.signature(
+        args=('send_mass_message_to_all_users_task',),
+        priority=TaskPriorityEnum.mass_message_for_all_users_task_priority))
+    return {'shards': len(shards), 'report_task_id': f'{result.id}'}
+
+
+@celery_app.task(name='send_mass_message_to_all_users_shard_task')
+def send_mass_message_to_all_users_shard_task(msg_text: str, id_from: int, id_to: int):
+    logger.debug(f'send_mass_message_to_all_users_shard_task started: {id_from=:} {id_to=:}')
+    repo = SqlAlchemyRepositorySync(SessionLocal())
     notificator = Notificator(repo)
-    asyncio.run(notificator.send_mass_message_to_all_users(msg_text))
+    report = run_notificator_coroutine(notificator.send_mass_message_to_all_users(msg_text, id_from, id_to))
     repo.session.close()
+    return report.as_dict()
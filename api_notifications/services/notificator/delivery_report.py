@@ -0,0 +1,45 @@
+from core.enums import DeliveryStatusEnum, NotificationChannelEnum
+
+
+class DeliveryReport:
+    """counts of users, created/left pending messages and delivery statuses per channel,
+    reports are plain dicts in celery results, so reports of different chunks/tasks can be merged"""
+
+    def __init__(self, users: int = 0, messages_created: int = 0, pending: int = 0, channels: dict | None = None):
+        self.users = users
+        self.messages_created = messages_created
+        self.pending = pending
+        self.channels = {channel: {status: 0 for status in DeliveryStatusEnum} for channel in NotificationChannelEnum}
+        for channel, statuses in (channels or {}).items():
+            for status, count in statuses.items():
+                self.channels[NotificationChannelEnum(channel)][DeliveryStatusEnum(status)] += count
+
+    def add(self, channel: NotificationChannelEnum, status: DeliveryStatusEnum, count: int = 1) -> None:
+        self.channels[channel][status] += count
+
+    def add_delivery(self, delivery: dict[NotificationChannelEnum, DeliveryStatusEnum]) -> None:
+        for channel, status in delivery.items():
+            self.add(channel, status)
+
+    def merge(self, other: 'DeliveryReport') -> 'DeliveryReport':
+        self.users += other.users
+        self.messages_created += other.messages_created
+        self.pending += other.pending
+        for channel, statuses in other.channels.items():
+            for status, count in statuses.items():
+                self.add(channel, status, count)
+        return self
+
+    def as_dict(self) -> dict:
+        return {'users': self.users,
+                'messages_created': self.messages_created,
+                'pending': self.pending,
+                'channels': {str(channel): {str(status): count for status, count in statuses.items()}
+                             for channel, statuses in self.channels.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'DeliveryReport':
+        return cls(**data)
+
+    def __repr__(self):
+        return f'<DeliveryReport> {self.as_dict()}'
@@ -0,0 +1,47 @@
+import functools
+from email import policy
+from email.message import EmailMessage
+
+import pydantic as pd
+
+from core.config import settings
+
+DEFAULT_SUBJECT = "Notification from cinema.online"
+# To of message sent to many recipients in one smtp transaction, addresses are only in the envelope
+UNDISCLOSED_RECIPIENTS = 'undisclosed-recipients:;'
+
+
+def build_email(email_to: pd.EmailStr | None,
+                msg_text: str,
+                msg_subject: str = DEFAULT_SUBJECT,
+                msg_from: pd.EmailStr = settings.EMAILS_FROM_EMAIL,
+                ) -> EmailMessage:
+    msg_text += "\nThis email was sent automatically, you don't need to reply to it.\n" \
+                "To cancel receiving - visit cinema.online settings and turn off email notifications."""
+    msg = EmailMessage()
+    msg['Subject'] = msg_subject
+    msg['From'] = msg_from
+    if email_to is not None:
+        msg['To'] = email_to
+    msg.set_content(msg_text)
+    return msg
+
+
+class PreparedEmail:
+    """message built and encoded once for all recipients of the same text,
+    only To header is prepended to the encoded bytes per recipient"""
+
+    def __init__(self, msg: EmailMessage):
+        self.from_addr = str(msg['From'])
+        self.data = msg.as_bytes(policy=policy.SMTP)
+
+    def with_to(self, email_to: str) -> bytes:
+        return policy.SMTP.fold_binary('To', policy.SMTP.header_factory('To', email_to)) + self.data
+
+
+@functools.lru_cache(maxsize=settings.MESSAGE_TEMPLATE_CACHE_SIZE)
+def prepare_email(msg_text: str,
+                  msg_subject: str = DEFAULT_SUBJECT,
+                  msg_from: pd.EmailStr = settings.EMAILS_FROM_EMAIL) -> PreparedEmail:
+    """mass message without placeholders has one text for all users, so it's encoded once per process"""
+    return PreparedEmail(build_email(None, msg_text, msg_subject, msg_from))
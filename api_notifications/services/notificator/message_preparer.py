@@ -1,41 +1,141 @@
+import functools
 import re
 
 import sqlalchemy as sa
 from sqlalchemy.exc import SQLAlchemyError
 
+from core.config import settings
 from core.enums import UserDataRenderPlaceholdersEnum, ResponseDetailEnum
 from core.exceptions import NotValidPlaceholdersException, AuthPostgresConnectionException
 from db import SessionLocalAuthSync
+from db.expressions import normalize_uuids
+from services.notificator.auth_user_cache import auth_user_data_cache
 from services.notificator.logger_config import logger
 
+PLACEHOLDER_PATTERN = re.compile(r'(%\w+%)')
+VALID_PLACEHOLDERS = frozenset(p.value for p in UserDataRenderPlaceholdersEnum)
+
+# auth_postgres public.user column rendered in place of each placeholder
+AUTH_USER_PLACEHOLDER_COLUMNS = {
+    UserDataRenderPlaceholdersEnum.user_name.value: 'name',
+}
+
+DIGEST_SEPARATOR = '\n\n'
+
+
+class MessageTemplate:
+    """msg_text parsed once into segments: literals at even positions, placeholders at odd positions"""
+
+    def __init__(self, msg_text: str):
+        self.msg_text = msg_text
+        self.segments = tuple(PLACEHOLDER_PATTERN.split(msg_text))
+        self.placeholders = self.segments[1::2]
+        self.valid_placeholders = frozenset(p for p in self.placeholders if p in VALID_PLACEHOLDERS)
+        self.not_valid_placeholders = [p for p in self.placeholders if p not in VALID_PLACEHOLDERS]
+
+    def render(self, values: dict[str, str]) -> str:
+        """join segments with values, placeholders without value are left as is"""
+        if not self.placeholders:
+            return self.msg_text
+        segments = list(self.segments)
+        segments[1::2] = [values.get(p, p) for p in self.placeholders]
+        return ''.join(segments)
+
+
+@functools.lru_cache(maxsize=settings.MESSAGE_TEMPLATE_CACHE_SIZE)
+def compile_message_template(msg_text: str) -> MessageTemplate:
+    return MessageTemplate(msg_text)
+
 
 async def validate_placeholders(msg_text: str):
     if msg_text:
-        placeholders = re.findall(r'%\w+%', msg_text)
-        if placeholders:
-            not_valid = []
-            for placeholder in placeholders:
-                if placeholder not in [p.value for p in UserDataRenderPlaceholdersEnum]:
-                    not_valid.append(placeholder)
-            if not_valid:
-                detail = f"{ResponseDetailEnum.not_valid_placeholders} {not_valid}"
-                raise NotValidPlaceholdersException(detail)
-
-
-def render_message_text_with_auth_user_data(user_uuid: str, msg_text: str):
-    placeholders = re.findall(r'%\w+%', msg_text)
-    if placeholders:
-        session = SessionLocalAuthSync()
-        try:
-            user_data_cur = session.execute(sa.text(f"select u.name from public.user u where uuid='{user_uuid}'"))
-            user_data = user_data_cur.first()
-        except SQLAlchemyError as e:
-            detail = f'failed render_message_text_with_auth_user_data: {user_uuid=:} {e}'
-            logger.error(detail)
-            raise AuthPostgresConnectionException(str(e))
-        finally:
-            session.close()
-        for p in placeholders:
-            if p == UserDataRenderPlaceholdersEnum.user_name:
-                msg_text = msg_text.replace(p, user_data[0])
-    return msg_text
+        not_valid = compile_message_template(msg_text).not_valid_placeholders
+        if not_valid:
+            detail = f"{ResponseDetailEnum.not_valid_placeholders} {not_valid}"
+            raise NotValidPlaceholdersException(detail)
+
+
+def select_auth_users_data(user_uuid_list: list[str]) -> dict[str, dict[str, str]]:
+    """get values of all placeholders of many users from auth_postgres with single query"""
+    placeholders = list(AUTH_USER_PLACEHOLDER_COLUMNS)
+    columns = ', '.join(f'u.{AUTH_USER_PLACEHOLDER_COLUMNS[p]}' for p in placeholders)
+    session = SessionLocalAuthSync()
+    try:
+        rows = session.execute(
+            sa.text(f"select u.uuid, {columns} from public.user u where u.uuid = any(cast(:uuids as uuid[]))"),
+            {'uuids': list(user_uuid_list)}).all()
+    except SQLAlchemyError as e:
+        detail = f'failed select_auth_users_data: {len(user_uuid_list)} users {e}'
+        logger.error(detail)
+        raise AuthPostgresConnectionException(str(e))
+    finally:
+        session.close()
+    return {str(user_uuid): dict(zip(placeholders, values)) for user_uuid, *values in rows}
+
+
+def get_auth_users_data(user_uuid_list: list[str]) -> dict[str, dict[str, str]]:
+    """read-through auth_user_data_cache, only not cached users are selected from auth_postgres,
+    uuids must be normalized (see normalize_uuids) as rows are keyed by them"""
+    users_data, missing = auth_user_data_cache.get_many(user_uuid_list)
+    if missing:
+        selected = select_auth_users_data(missing)
+        auth_user_data_cache.set_many(selected)
+        users_data.update(selected)
+    return users_data
+
+
+def invalidate_auth_users_data(user_uuid_list: list[str]) -> None:
+    """to be called when user data changes in auth service"""
+    auth_user_data_cache.invalidate(user_uuid_list)
+
+
+def render_message_text_for_users(user_uuid_list: list[str], msg_text: str) -> dict[str, str]:
+    """render msg_text for many users with single auth_postgres query,
+    text without placeholders is the same for all of them and isn't rendered"""
+    template = compile_message_template(msg_text)
+    if not template.valid_placeholders:
+        return dict.fromkeys(user_uuid_list, msg_text)
+    # callers pass uuids as hex or hyphenated, auth_postgres rows and cache are keyed by hyphenated form
+    normalized_uuids = normalize_uuids(user_uuid_list)
+    users_data = get_auth_users_data(normalized_uuids)
+    texts = {}
+    for user_uuid, normalized_uuid in zip(user_uuid_list, normalized_uuids):
+        user_data = users_data.get(normalized_uuid)
+        if user_data is None:
+            logger.warning(f'render_message_text_for_users: {user_uuid=:} not found in auth_postgres')
+            user_data = {}
+        texts[user_uuid] = template.render({p: user_data.get(p) or '' for p in template.valid_placeholders})
+    return texts
+
+
+def render_message_text_with_auth_user_data(user_uuid: str, msg_text: str) -> str:
+    return render_message_text_for_users([user_uuid], msg_text)[user_uuid]
+
+
+def render_digest(texts: list[str]) -> str:
+    return DIGEST_SEPARATOR.join([f'You have {len(texts)} new notifications:', *texts])
+
+
+def split_digests(texts: list[str],
+                  max_messages: int = settings.PENDING_DIGEST_MAX_MESSAGES,
+                  max_chars: int = settings.PENDING_DIGEST_MAX_CHARS) -> list[list[int]]:
+    """pack rendered texts of one user in order into as few digests as possible, each one of up to max_messages
+    texts and max_chars characters (longer text goes alone), returns indexes of texts of every digest"""
+    parts, part, size = [], [], 0
+    for i, text in enumerate(texts):
+        if part and (len(part) >= max_messages or size + len(DIGEST_SEPARATOR) + len(text) > max_chars):
+            parts.append(part)
+            part, size = [], 0
+        part.append(i)
+        size += len(DIGEST_SEPARATOR) + len(text)
+    if part:
+        parts.append(part)
+    return parts
+
+
+def build_digests(texts: list[str],
+                  max_messages: int = settings.PENDING_DIGEST_MAX_MESSAGES,
+                  max_chars: int = settings.PENDING_DIGEST_MAX_CHARS) -> list[str]:
+    """digests of split_digests, single text is delivered as is"""
+    return [texts[part[0]] if len(part) == 1 else render_digest([texts[i] for i in part])
+            for part in split_digests(texts, max_messages, max_chars)]
@@ -1,137 +1,611 @@
+import asyncio
 import datetime as dt
+import math
 import smtplib
-from email.message import EmailMessage
+import time
+import weakref
+from collections.abc import Coroutine, Iterable
 
 import fastapi as fa
 import httpx
 import pydantic as pd
 import pytz
+from sqlalchemy.orm import joinedload
 from core import config
 from core.config import settings
-from core.enums import MessagePriorityEnum
+from core.enums import DeliveryStatusEnum, MessagePriorityEnum, NotificationChannelEnum
+from core.http_client import AsyncHTTPClientHolder
+from core.metrics import SEND_SECONDS, observe_delivery
 from core.timezones import TIMEZONES_DICT
+from db.expressions import in_array
 from db.models.message import MessageModel
 from db.models.user import UserModel
 from db.repository_sync import SqlAlchemyRepositorySync
 from db.serializers.message import MessageCreateSerializer
+from services.notificator.delivery_report import DeliveryReport
+from services.notificator.email_builder import DEFAULT_SUBJECT, UNDISCLOSED_RECIPIENTS, prepare_email
 from services.notificator.logger_config import logger
-from services.notificator.message_preparer import render_message_text_with_auth_user_data
+from services.notificator.message_preparer import (
+    build_digests,
+    render_message_text_for_users,
+    render_message_text_with_auth_user_data,
+    split_digests,
+)
+from services.notificator.rate_limiter import rate_limiters
+from services.notificator.smtp_pool import smtp_pool
+
+# telegram allows ~30 messages per second per bot, no point in keeping more connections to it
+telegram_http_client = AsyncHTTPClientHolder(
+    'telegram',
+    base_url=f'{settings.TG_API_URL}/{settings.TG_BOT_ID}',
+    http2=settings.TG_HTTP2,
+    timeout=settings.TG_HTTP_TIMEOUT,
+    limits=httpx.Limits(max_connections=settings.TG_HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=settings.TG_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=settings.TG_HTTP_KEEPALIVE_EXPIRY),
+)
+
+# smtp replies of relay asking to slow down / retry later
+SMTP_THROTTLE_CODES = frozenset({421, 450, 451, 452})
+
+# external delivery statuses pending message is rescheduled for
+RETRIED_STATUSES = frozenset({DeliveryStatusEnum.failed, DeliveryStatusEnum.throttled})
+
+_email_semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = \
+    weakref.WeakKeyDictionary()
+
+
+def get_email_semaphore() -> asyncio.Semaphore:
+    """semaphore bounding emails in flight, one per event loop (asyncio primitives can't be shared between loops)"""
+    loop = asyncio.get_running_loop()
+    semaphore = _email_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _email_semaphores[loop] = asyncio.Semaphore(settings.EMAIL_MAX_CONCURRENCY)
+    return semaphore
+
+
+async def run_concurrently(coros: Iterable[Coroutine], limit: int) -> None:
+    """run coroutines keeping at most 'limit' of them in flight, coroutines are created lazily from 'coros'"""
+    in_flight = set()
+
+    def log_failed(done_tasks):
+        for task in done_tasks:
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(f"notificator coroutine failed: {task.exception()}")
+
+    for coro in coros:
+        if len(in_flight) >= limit:
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            log_failed(done)
+        in_flight.add(asyncio.ensure_future(coro))
+    if in_flight:
+        done, _ = await asyncio.wait(in_flight)
+        log_failed(done)
 
 
 class Notificator:
+    """sync repo and auth_postgres render calls are run in threads, so db round trips don't stall sends
+    of other coroutines of the loop (tasks sharing the persistent loop, api requests)"""
 
     def __init__(self, repo: SqlAlchemyRepositorySync | None = None):
         self.repo = repo
 
+    @staticmethod
+    async def block_email_if_throttled(codes: Iterable[int]) -> DeliveryStatusEnum:
+        """block email channel if relay asked to retry later, returns status of the failed send"""
+        if SMTP_THROTTLE_CODES.intersection(codes):
+            await rate_limiters[NotificationChannelEnum.email].block(settings.EMAIL_THROTTLE_BACKOFF_SECONDS)
+            return DeliveryStatusEnum.throttled
+        return DeliveryStatusEnum.failed
+
     async def send_email(self,
                          email_to: pd.EmailStr,
                          msg_text: str,
-                         msg_subject: str = "Notification from cinema.online",
+                         msg_subject: str = DEFAULT_SUBJECT,
                          msg_from: pd.EmailStr = settings.EMAILS_FROM_EMAIL,
-                         ):
+                         ) -> DeliveryStatusEnum:
+        """message of the same text is encoded once (prepare_email cache), only To is set per addressee,
+        EMAIL_CHANNEL_TIMEOUT bounds the smtp send only, not waits for rate limiter and free session,
+        returned status isn't observed here, callers do it (deliveries to users - _deliver_to_channel)"""
         try:
-            msg_text += "\nThis email was sent automatically, you don't need to reply to it.\n" \
-                        "To cancel receiving - visit cinema.online settings and turn off email notifications."""
-            msg = EmailMessage()
-            msg['Subject'] = msg_subject
-            msg['From'] = msg_from
-            msg['To'] = email_to
-            msg.set_content(msg_text)
-
-            with smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT) as smtp:
-                smtp.send_message(msg)
+            prepared = prepare_email(msg_text, msg_subject, msg_from)
+            await rate_limiters[NotificationChannelEnum.email].acquire()
+            async with get_email_semaphore():
+                with SEND_SECONDS.labels(NotificationChannelEnum.email.value).time():
+                    await asyncio.wait_for(asyncio.to_thread(smtp_pool.sendmail, prepared.from_addr, [email_to],
+                                                             prepared.with_to(email_to)),
+                                           settings.EMAIL_CHANNEL_TIMEOUT)
             logger.debug(f"email sending success to {email_to=:}")
+            return DeliveryStatusEnum.delivered
+        except smtplib.SMTPResponseException as e:
+            logger.error(f"email sending failed to {email_to=:}: {e}")
+            return await self.block_email_if_throttled([e.smtp_code])
+        except smtplib.SMTPRecipientsRefused as e:
+            logger.error(f"email sending failed to {email_to=:}: {e}")
+            return await self.block_email_if_throttled(code for code, _ in e.recipients.values())
+        except asyncio.TimeoutError:
+            logger.error(f"email sending to {email_to=:} timed out after {settings.EMAIL_CHANNEL_TIMEOUT}s")
+            return DeliveryStatusEnum.failed
         except Exception as e:
             logger.error(f"email sending failed to {email_to=:}: {e}")
+            return DeliveryStatusEnum.failed
+
+    async def send_emails(self,
+                          email_to_list: list[pd.EmailStr],
+                          msg_text: str,
+                          msg_subject: str = DEFAULT_SUBJECT,
+                          msg_from: pd.EmailStr = settings.EMAILS_FROM_EMAIL,
+                          ) -> dict[str, DeliveryStatusEnum]:
+        """send the same text to many addressees, message is encoded once and sent by up to EMAIL_MAX_CONCURRENCY
+        sessions, each one sends its part of addressees one after another:
+            -EMAIL_BATCH_RECIPIENTS == 1 - one smtp transaction per addressee, only To is swapped
+            -EMAIL_BATCH_RECIPIENTS > 1 - one transaction per that many addressees (RCPT TO), they aren't
+            disclosed to each other (To: undisclosed-recipients), relay must accept that many recipients
+        returns status per address"""
+        if not email_to_list:
+            return {}
+        prepared = prepare_email(msg_text, msg_subject, msg_from)
+        batch_size = max(1, settings.EMAIL_BATCH_RECIPIENTS)
+        if batch_size == 1:
+            envelopes = [(prepared.from_addr, [email_to], prepared.with_to(email_to)) for email_to in email_to_list]
+        else:
+            data = prepared.with_to(UNDISCLOSED_RECIPIENTS)
+            envelopes = [(prepared.from_addr, email_to_list[i:i + batch_size], data)
+                         for i in range(0, len(email_to_list), batch_size)]
+        await rate_limiters[NotificationChannelEnum.email].acquire(len(email_to_list))
+
+        async def send_part(part: list[tuple[str, list[str], bytes]]) -> dict[str, Exception]:
+            async with get_email_semaphore():
+                with SEND_SECONDS.labels(NotificationChannelEnum.email.value).time():
+                    return await asyncio.to_thread(smtp_pool.send_envelopes, part)
+
+        parts_count = min(settings.EMAIL_MAX_CONCURRENCY, len(envelopes))
+        failed = {}
+        for part_failed in await asyncio.gather(*(send_part(envelopes[i::parts_count]) for i in range(parts_count))):
+            failed.update(part_failed)
+        statuses = dict.fromkeys(email_to_list, DeliveryStatusEnum.delivered)
+        for email_to, e in failed.items():
+            statuses[email_to] = DeliveryStatusEnum.failed
+            if isinstance(e, smtplib.SMTPResponseException):
+                statuses[email_to] = await self.block_email_if_throttled([e.smtp_code])
+            elif isinstance(e, smtplib.SMTPRecipientsRefused):
+                statuses[email_to] = await self.block_email_if_throttled(code for code, _ in e.recipients.values())
+            logger.error(f"email sending failed to {email_to=:}: {e}")
+        logger.debug(f"email sending finished for {len(email_to_list)} addressees, {len(failed)} failed")
+        return statuses
+
+    async def send_emails_to_users(self,
+                                   deliveries: list[tuple[UserModel, str]]) -> list[DeliveryStatusEnum]:
+        """email channel of many (user, rendered text) deliveries at once: they are grouped by text,
+        so each distinct text is encoded once and sent by send_emails, returns statuses in order of deliveries"""
+        statuses = [DeliveryStatusEnum.failed] * len(deliveries)
+        indexes_by_text = {}
+        for i, (user, msg_text) in enumerate(deliveries):
+            if not user.is_accepting_emails:
+                statuses[i] = DeliveryStatusEnum.skipped
+            elif user.email:
+                indexes_by_text.setdefault(msg_text, []).append(i)
+        for msg_text, indexes in indexes_by_text.items():
+            try:
+                by_email = await self.send_emails([deliveries[i][0].email for i in indexes], msg_text)
+            except Exception as e:
+                logger.error(f"email sending failed to {len(indexes)} users: {e}")
+                continue
+            for i in indexes:
+                statuses[i] = by_email[deliveries[i][0].email]
+        for status in statuses:
+            observe_delivery(NotificationChannelEnum.email, status)
+        return statuses
 
     async def send_email_to_user(self,
                                  user: UserModel,
                                  msg_text: str,
-                                 msg_subject: str = "Notification from cinema.online",
-                                 msg_from: pd.EmailStr = settings.EMAILS_FROM_EMAIL) -> None:
-        if user.is_accepting_emails:
-            await self.send_email(user.email, msg_text, msg_subject, msg_from)
+                                 msg_subject: str = DEFAULT_SUBJECT,
+                                 msg_from: pd.EmailStr = settings.EMAILS_FROM_EMAIL) -> DeliveryStatusEnum:
+        if not user.is_accepting_emails:
+            return DeliveryStatusEnum.skipped
+        return await self.send_email(user.email, msg_text, msg_subject, msg_from)
 
     async def send_telegram_to_user(self,
                                     user: UserModel,
-                                    msg_text: str) -> None:
-        """sends message to user.telegram_id using telegram api"""
-        if user.is_accepting_telegram and user.telegram_id:
-            try:
-                msg_text += "\nMore information at cinema.online."
-                data = {"chat_id": user.telegram_id, "text": msg_text}
-                async with httpx.AsyncClient() as client:
-                    resp = await client.post(url=f"https://api.telegram.org/{settings.TG_BOT_ID}/sendMessage",
-                                             data=data)
-                    if resp.status_code == fa.status.HTTP_200_OK:
-                        logger.debug(f"telegram sending success to {user=:}.")
-                    else:
-                        logger.error(f"telegram sending failed to {user=:}. {resp.status_code=:}, {resp.text=:}")
-            except (httpx._exceptions.RequestError, httpx._exceptions.HTTPError) as e:
-                logger.error(f"telegram sending failed to {user=:}: {e}")
-
-    async def notify_interface_message_to_user(self, user: UserModel, message: MessageModel) -> None:
-        if user.is_accepting_interface_messages:
-            self.repo.update(message, {'is_notified': True})
-            logger.debug(f"interface_message success notified to {user=:}.")
-
-    async def create_and_notify_interface_message_to_user(self, user: UserModel, msg_text: str) -> None:
+                                    msg_text: str) -> DeliveryStatusEnum:
+        """sends message to user.telegram_id using telegram api, sends are paced by shared telegram rate limiter,
+        on 429 the whole channel is blocked for 'retry_after' and message is retried up to TELEGRAM_MAX_RETRIES times,
+        then it's 'throttled'; TELEGRAM_CHANNEL_TIMEOUT bounds every request, not waits for rate limiter"""
+        if not (user.is_accepting_telegram and user.telegram_id):
+            return DeliveryStatusEnum.skipped
+        limiter = rate_limiters[NotificationChannelEnum.telegram]
+        try:
+            msg_text += "\nMore information at cinema.online."
+            data = {"chat_id": user.telegram_id, "text": msg_text}
+            for _ in range(settings.TELEGRAM_MAX_RETRIES + 1):
+                await limiter.acquire()
+                with SEND_SECONDS.labels(NotificationChannelEnum.telegram.value).time():
+                    resp = await asyncio.wait_for(telegram_http_client.get().post(url='/sendMessage', data=data),
+                                                  settings.TELEGRAM_CHANNEL_TIMEOUT)
+                if resp.status_code == fa.status.HTTP_200_OK:
+                    logger.debug(f"telegram sending success to {user=:}.")
+                    return DeliveryStatusEnum.delivered
+                if resp.status_code != fa.status.HTTP_429_TOO_MANY_REQUESTS:
+                    break
+                await limiter.block(self.get_telegram_retry_after(resp))
+            else:
+                logger.warning(f"telegram sending throttled to {user=:}, {settings.TELEGRAM_MAX_RETRIES=:} exhausted")
+                return DeliveryStatusEnum.throttled
+            logger.error(f"telegram sending failed to {user=:}. {resp.status_code=:}, {resp.text=:}")
+        except asyncio.TimeoutError:
+            logger.error(f"telegram sending to {user=:} timed out after {settings.TELEGRAM_CHANNEL_TIMEOUT}s")
+        except (httpx._exceptions.RequestError, httpx._exceptions.HTTPError) as e:
+            logger.error(f"telegram sending failed to {user=:}: {e}")
+        return DeliveryStatusEnum.failed
+
+    @staticmethod
+    def get_telegram_retry_after(resp: httpx.Response, default: float = 1.0) -> float:
+        """seconds to wait from telegram 429 response: {"parameters": {"retry_after": 35}, ...}"""
+        try:
+            return float(resp.json()['parameters']['retry_after'])
+        except (ValueError, KeyError, TypeError):
+            return default
+
+    async def notify_interface_message_to_user(self, user: UserModel, message: MessageModel) -> DeliveryStatusEnum:
+        """mark pending message notified, if user doesn't accept interface messages it stays not notified
+        but is unscheduled (deliver_after=None), so dispatcher doesn't pick it up again"""
+        if not user.is_accepting_interface_messages:
+            if message.deliver_after is not None:
+                await asyncio.to_thread(self.repo.update, message, {'deliver_after': None})
+            return DeliveryStatusEnum.skipped
+        await asyncio.to_thread(self.repo.update, message, {'is_notified': True})
+        logger.debug(f"interface_message success notified to {user=:}.")
+        return DeliveryStatusEnum.delivered
+
+    async def create_and_notify_interface_message_to_user(self, user: UserModel, msg_text: str) -> DeliveryStatusEnum:
         """if user is accepting interface message: creates it and notifies it immediately"""
-        if user.is_accepting_interface_messages:
-            self.repo.create(MessageModel,
-                             MessageCreateSerializer(to_user_uuid=user.uuid,
-                                                     text=msg_text,
-                                                     priority=MessagePriorityEnum.individual_immediate,
-                                                     is_notified=True))
-            logger.debug(f"interface_message success created and notified to {user=:}.")
-
-    async def send_individual_immediate_message(self, user_uuid, msg_text):
-        """send messages to all communication ways immediately"""
-        msg_text = render_message_text_with_auth_user_data(user_uuid, msg_text)
+        if not user.is_accepting_interface_messages:
+            return DeliveryStatusEnum.skipped
+        await asyncio.to_thread(self.repo.create,
+                                MessageModel,
+                                MessageCreateSerializer(to_user_uuid=user.uuid,
+                                                        text=msg_text,
+                                                        priority=MessagePriorityEnum.individual_immediate,
+                                                        is_notified=True))
+        logger.debug(f"interface_message success created and notified to {user=:}.")
+        return DeliveryStatusEnum.delivered
+
+    @staticmethod
+    async def _deliver_to_channel(channel: NotificationChannelEnum, coro: Coroutine) -> DeliveryStatusEnum:
+        """await channel delivery, so that its error is reported as 'failed' for this channel only
+        (senders time out their own requests, so waits for rate limiter don't fail the delivery)"""
+        status = DeliveryStatusEnum.failed
+        try:
+            status = await coro
+        except Exception as e:
+            logger.error(f"{channel} delivery failed: {e}")
+        observe_delivery(channel, status)
+        return status
 
+    async def deliver_to_user_external_channels(
+            self,
+            user: UserModel,
+            msg_text: str,
+            email: bool = True) -> dict[NotificationChannelEnum, DeliveryStatusEnum]:
+        """send msg_text by email and telegram concurrently, email=False - only by telegram
+        (email is sent to many users at once by caller)"""
+        if not email:
+            return {NotificationChannelEnum.telegram: await self._deliver_to_channel(
+                NotificationChannelEnum.telegram,
+                self.send_telegram_to_user(user, msg_text))}
+        email_status, telegram_status = await asyncio.gather(
+            self._deliver_to_channel(NotificationChannelEnum.email, self.send_email_to_user(user, msg_text)),
+            self._deliver_to_channel(NotificationChannelEnum.telegram, self.send_telegram_to_user(user, msg_text)),
+        )
+        return {NotificationChannelEnum.email: email_status,
+                NotificationChannelEnum.telegram: telegram_status}
+
+    async def deliver_to_users_external_channels(
+            self,
+            deliveries: list[tuple[UserModel, str]],
+            report: DeliveryReport) -> list[dict[NotificationChannelEnum, DeliveryStatusEnum]]:
+        """deliver many (user, rendered text), statuses are added to report and returned in order of deliveries:
+            -EMAIL_BATCH_RECIPIENTS == 1 - each one by deliver_to_user_external_channels,
+            up to MASS_MESSAGE_MAX_CONCURRENCY at once
+            -EMAIL_BATCH_RECIPIENTS > 1 - telegram the same way, emails with send_emails_to_users
+            in multi-recipient transactions"""
+        batch_emails = settings.EMAIL_BATCH_RECIPIENTS > 1
+        statuses = [{} for _ in deliveries]
+
+        async def deliver(i: int, user: UserModel, msg_text: str):
+            delivery = await self.deliver_to_user_external_channels(user, msg_text, email=not batch_emails)
+            statuses[i].update(delivery)
+            report.add_delivery(delivery)
+
+        async def deliver_emails():
+            for i, status in enumerate(await self.send_emails_to_users(deliveries)):
+                statuses[i][NotificationChannelEnum.email] = status
+                report.add(NotificationChannelEnum.email, status)
+
+        await asyncio.gather(
+            run_concurrently((deliver(i, user, msg_text) for i, (user, msg_text) in enumerate(deliveries)),
+                             limit=settings.MASS_MESSAGE_MAX_CONCURRENCY),
+            *([deliver_emails()] if batch_emails else []),
+        )
+        return statuses
+
+    def get_retry_deliver_after(self,
+                                user: UserModel,
+                                delivery: dict[NotificationChannelEnum, DeliveryStatusEnum],
+                                now: dt.datetime) -> dt.datetime | None:
+        """when to deliver pending message again after its email/telegram delivery failed or was throttled:
+        in PENDING_RETRY_SECONDS or when the throttled channel is unblocked (within user's available hours),
+        None - not retried: nothing failed, or it's delivered by other channel, which would get it twice"""
+        statuses = set(delivery.values())
+        if DeliveryStatusEnum.delivered in statuses or not statuses & RETRIED_STATUSES:
+            return None
+        retry_in = max([settings.PENDING_RETRY_SECONDS] + [rate_limiters[channel].blocked_for()
+                                                           for channel, status in delivery.items()
+                                                           if status == DeliveryStatusEnum.throttled])
+        # whole seconds, so messages of the batch are rescheduled to a few instants by a few updates
+        return self.get_deliver_after(user, now + dt.timedelta(seconds=math.ceil(retry_in)))
+
+    async def deliver_to_user(self,
+                              user: UserModel,
+                              msg_text: str,
+                              message: MessageModel | None = None) -> dict[NotificationChannelEnum, DeliveryStatusEnum]:
+        """deliver msg_text to all user's communication ways concurrently,
+            -if 'message' (pending interface message) is provided - it is marked as notified
+            -else interface message is created already notified"""
+        if message is not None:
+            interface_coro = self.notify_interface_message_to_user(user, message)
+        else:
+            interface_coro = self.create_and_notify_interface_message_to_user(user, msg_text)
+        external_delivery, interface_status = await asyncio.gather(
+            self.deliver_to_user_external_channels(user, msg_text),
+            self._deliver_to_channel(NotificationChannelEnum.interface, interface_coro),
+        )
+        return {**external_delivery, NotificationChannelEnum.interface: interface_status}
+
+    def get_detached_user(self, user_uuid: str) -> UserModel:
+        """user detached from session, so commits of its messages don't expire it: attributes aren't re-selected
+        on access from the loop while session is used by a thread"""
         user = self.repo.get(UserModel, uuid=user_uuid)
-        await self.send_email_to_user(user, msg_text)
-        await self.send_telegram_to_user(user, msg_text)
-        await self.create_and_notify_interface_message_to_user(user, msg_text)
+        self.repo.session.expunge(user)
+        return user
 
-    async def send_individual_pending_message(self, user_uuid: str, msg_text: str,
-                                              priority=MessagePriorityEnum.individual_pending, user=None):
-        """firstly create message as 'pending' (is_notified=False), and
-            -if users current_time.hour is in users 'available_hours' - send it immediately
-            -else message stays pending and scheduled sender will send it when user timezone allows it"""
-        msg_text = render_message_text_with_auth_user_data(user_uuid, msg_text)
-        message = self.repo.create(MessageModel,
-                                   MessageCreateSerializer(to_user_uuid=user_uuid,
-                                                           text=msg_text,
-                                                           priority=priority,
-                                                           is_notified=False))
-        if user is None:
-            user = self.repo.get(UserModel, uuid=user_uuid)
+    @staticmethod
+    def is_user_available_now(user: UserModel) -> bool:
         user_current_time = dt.datetime.now(pytz.timezone(TIMEZONES_DICT[user.timezone]))
+        return user_current_time.hour in config.USER_NOTIFICATION_AVAILABLE_HOURS
+
+    @staticmethod
+    def get_deliver_after(user: UserModel, now: dt.datetime | None = None) -> dt.datetime:
+        """earliest utc instant (naive, as message.deliver_after is stored) since 'now' when user's local hour
+        is in USER_NOTIFICATION_AVAILABLE_HOURS: 'now' itself or start of the next available local hour"""
+        tz = pytz.timezone(TIMEZONES_DICT[user.timezone])
+        now = (now or dt.datetime.utcnow()).replace(tzinfo=pytz.utc)
+        user_current_time = now.astimezone(tz)
         if user_current_time.hour in config.USER_NOTIFICATION_AVAILABLE_HOURS:
-            await self.send_email_to_user(user, msg_text)
-            await self.send_telegram_to_user(user, msg_text)
-            await self.notify_interface_message_to_user(user, message)
+            return now.replace(tzinfo=None)
+        hour_start = user_current_time.replace(minute=0, second=0, microsecond=0)
+        for hours in range(1, 49):
+            candidate = tz.normalize(hour_start + dt.timedelta(hours=hours))
+            if candidate.hour in config.USER_NOTIFICATION_AVAILABLE_HOURS:
+                return candidate.astimezone(pytz.utc).replace(tzinfo=None)
+        return now.replace(tzinfo=None)
+
+    async def send_individual_immediate_message(
+            self,
+            user_uuid: str,
+            msg_text: str) -> dict[NotificationChannelEnum, DeliveryStatusEnum]:
+        """send messages to all communication ways immediately"""
+        msg_text = await asyncio.to_thread(render_message_text_with_auth_user_data, user_uuid, msg_text)
+        user = await asyncio.to_thread(self.get_detached_user, user_uuid)
+        return await self.deliver_to_user(user, msg_text)
+
+    async def send_individual_pending_message(self, user_uuid: str, msg_text: str,
+                                              priority=MessagePriorityEnum.individual_pending):
+        """firstly create message as 'pending' (is_notified=False), and
+            -if users current_time.hour is in users 'available_hours' - send it immediately, message is created
+            unscheduled (deliver_after=None), so dispatcher can't pick it up and send it again meanwhile
+            -else message stays pending and scheduled sender will send it after its 'deliver_after'
+            (start of the next available hour of user)"""
+        msg_text = await asyncio.to_thread(render_message_text_with_auth_user_data, user_uuid, msg_text)
+        user = await asyncio.to_thread(self.get_detached_user, user_uuid)
+        now = dt.datetime.utcnow()
+        deliver_after = self.get_deliver_after(user, now)
+        deliver_now = deliver_after == now
+        message = await asyncio.to_thread(self.repo.create,
+                                          MessageModel,
+                                          MessageCreateSerializer(to_user_uuid=user_uuid,
+                                                                  text=msg_text,
+                                                                  priority=priority,
+                                                                  is_notified=False,
+                                                                  deliver_after=None if deliver_now else deliver_after))
+        if deliver_now:
+            await self.deliver_to_user(user, msg_text, message)
 
-    async def send_mass_message_to_user_uuid_list(self, user_uuid_list: list[str], msg_text: str):
+    async def send_mass_message_to_users_chunk(self,
+                                               users: list[UserModel],
+                                               msg_text: str,
+                                               priority: MessagePriorityEnum) -> DeliveryReport:
+        """create pending messages for chunk of users with single insert, deliver them to users available now
+        and mark their interface messages notified with single update, messages of other users are scheduled
+        to the start of their next available hour; messages delivered here are inserted unscheduled
+        (deliver_after=None), so dispatcher can't claim and send them again while this chunk is being sent,
+        ones email/telegram failed for are scheduled for retry instead (see get_retry_deliver_after)"""
+        report = DeliveryReport(users=len(users))
+        texts = await asyncio.to_thread(render_message_text_for_users, [user.uuid for user in users], msg_text)
+        now = dt.datetime.utcnow()
+        deliver_after = {user.uuid: self.get_deliver_after(user, now) for user in users}
+        rows = await asyncio.to_thread(
+            self.repo.create_many_returning,
+            MessageModel,
+            [MessageCreateSerializer(to_user_uuid=user.uuid, text=texts[user.uuid], priority=priority, is_notified=False,
+                                     deliver_after=None if deliver_after[user.uuid] == now else deliver_after[user.uuid])
+             for user in users],
+            MessageModel.id, MessageModel.to_user_uuid)
+        message_id_by_user_uuid = {row.to_user_uuid: row.id for row in rows}
+        available_users = [user for user in users if deliver_after[user.uuid] == now]
+        report.messages_created = len(rows)
+        report.pending = len(users) - len(available_users)
+
+        statuses = await self.deliver_to_users_external_channels(
+            [(user, texts[user.uuid]) for user in available_users], report)
+
+        settled_users, rescheduled = [], {}
+        for user, delivery in zip(available_users, statuses):
+            retry_deliver_after = self.get_retry_deliver_after(user, delivery, now)
+            if retry_deliver_after is None:
+                settled_users.append(user)
+            else:
+                rescheduled.setdefault(retry_deliver_after, []).append(message_id_by_user_uuid[user.uuid])
+        notified_message_ids = [message_id_by_user_uuid[user.uuid]
+                                for user in settled_users if user.is_accepting_interface_messages]
+        await asyncio.to_thread(self.settle_pending_messages, notified_message_ids, notified_message_ids, rescheduled)
+        report.pending += sum(len(message_ids) for message_ids in rescheduled.values())
+        report.add(NotificationChannelEnum.interface, DeliveryStatusEnum.delivered, len(notified_message_ids))
+        report.add(NotificationChannelEnum.interface, DeliveryStatusEnum.skipped,
+                   len(settled_users) - len(notified_message_ids))
+        observe_delivery(NotificationChannelEnum.interface, DeliveryStatusEnum.delivered, len(notified_message_ids))
+        observe_delivery(NotificationChannelEnum.interface, DeliveryStatusEnum.skipped,
+                         len(settled_users) - len(notified_message_ids))
+        return report
+
+    async def send_mass_message_by_chunks(self,
+                                          user_chunks: Iterable[list[UserModel]],
+                                          msg_text: str,
+                                          priority: MessagePriorityEnum) -> DeliveryReport:
+        report = DeliveryReport()
+        start = time.perf_counter()
+        # every next chunk is selected in a thread as well
+        user_chunks = iter(user_chunks)
+        while (users := await asyncio.to_thread(next, user_chunks, None)) is not None:
+            report.merge(await self.send_mass_message_to_users_chunk(users, msg_text, priority))
+            logger.info(f"mass message {priority=:}: {report.users} users processed, "
+                        f"{report.users / (time.perf_counter() - start):.1f} users/s")
+        logger.info(f"mass message {priority=:} finished in {time.perf_counter() - start:.1f}s: {report}")
+        return report
+
+    async def send_mass_message_to_user_uuid_list(self, user_uuid_list: list[str], msg_text: str) -> DeliveryReport:
         """create pending messages for filtered users"""
-        for user_uuid in user_uuid_list:
-            await self.send_individual_pending_message(user_uuid=user_uuid, msg_text=msg_text,
-                                                       priority=MessagePriorityEnum.mass_filtered_users)
-
-    async def send_mass_message_to_all_users(self, msg_text: str):
-        """create pending messages for all users"""
-        for user in self.repo.get_all(UserModel):
-            await self.send_individual_pending_message(user_uuid=user.uuid, msg_text=msg_text,
-                                                       priority=MessagePriorityEnum.mass_all_users,
-                                                       user=user)
-
-    async def check_availability_and_notify_pending_messages_by_uuid_list(self, pending_messages_uuids: list[str]):
-        """check users timezone availability and notify message"""
-        for message_uuid in pending_messages_uuids:
-            message = self.repo.get(MessageModel, uuid=message_uuid)
-            user_current_time = dt.datetime.now(pytz.timezone(TIMEZONES_DICT[message.to_user.timezone]))
-            if user_current_time.hour in config.USER_NOTIFICATION_AVAILABLE_HOURS:
-                await self.send_email_to_user(message.to_user, message.text)
-                await self.send_telegram_to_user(message.to_user, message.text)
-                await self.notify_interface_message_to_user(message.to_user, message)
+        user_chunks = self.repo.get_chunks_by_uuid_list(UserModel, user_uuid_list, settings.MASS_MESSAGE_CHUNK_SIZE)
+        return await self.send_mass_message_by_chunks(user_chunks, msg_text, MessagePriorityEnum.mass_filtered_users)
+
+    async def send_mass_message_to_all_users(self, msg_text: str,
+                                             id_from: int | None = None, id_to: int | None = None) -> DeliveryReport:
+        """create pending messages for all users (or users with id_from <= user.id <= id_to)"""
+        user_chunks = self.repo.get_chunks_by_id(UserModel, settings.MASS_MESSAGE_CHUNK_SIZE, id_from, id_to)
+        return await self.send_mass_message_by_chunks(user_chunks, msg_text, MessagePriorityEnum.mass_all_users)
+
+    @staticmethod
+    def get_pending_deliveries(messages: list[MessageModel]
+                               ) -> tuple[list[tuple[UserModel, str]], list[list[MessageModel]]]:
+        """(user, text) to send by external channels for every message, with PENDING_DIGEST - for every digest
+        of messages of the same user (interface messages are still notified one by one),
+        and messages of every delivery"""
+        if not settings.PENDING_DIGEST:
+            return [(message.to_user, message.text) for message in messages], [[message] for message in messages]
+        messages_by_user: dict[str, tuple[UserModel, list[MessageModel]]] = {}
+        for message in messages:
+            messages_by_user.setdefault(message.to_user.uuid, (message.to_user, []))[1].append(message)
+        deliveries, delivery_messages = [], []
+        for user, user_messages in messages_by_user.values():
+            texts = [message.text for message in user_messages]
+            for digest, part in zip(build_digests(texts), split_digests(texts)):
+                deliveries.append((user, digest))
+                delivery_messages.append([user_messages[i] for i in part])
+        logger.debug(f"pending digest: {len(messages)} messages of {len(messages_by_user)} users "
+                     f"coalesced into {len(deliveries)} deliveries")
+        return deliveries, delivery_messages
+
+    def settle_pending_messages(self,
+                                settled_ids: list[int],
+                                notified_ids: list[int],
+                                rescheduled: dict[dt.datetime, list[int]]) -> None:
+        """unschedule settled messages (notified_ids of them are marked notified) and reschedule others
+        in one transaction (of dispatcher it's the claiming one, so commit releases the locks)"""
+        self.repo.update_many_by_id_list(MessageModel, settled_ids,
+                                         {'is_notified': in_array(MessageModel.id, notified_ids),
+                                          'deliver_after': None},
+                                         commit=False)
+        for deliver_after, message_ids in rescheduled.items():
+            self.repo.update_many_by_id_list(MessageModel, message_ids, {'deliver_after': deliver_after}, commit=False)
+        self.repo.session.commit()
+
+    async def notify_claimed_pending_messages(self, messages: list[MessageModel]) -> DeliveryReport:
+        """deliver pending messages claimed (locked) by this session concurrently and settle the batch:
+            -delivered ones with single update (is_notified if user accepts interface messages, unscheduled)
+            -ones of users not available now (timezone was changed after scheduling) are rescheduled
+            -ones email/telegram failed for are rescheduled for retry (see get_retry_deliver_after) until they are
+            PENDING_RETRY_MAX_AGE_SECONDS old
+        commit releases the locks"""
+        report = DeliveryReport(users=len(messages))
+        now = dt.datetime.utcnow()
+        deliverable, rescheduled, orphaned_ids = [], {}, []
+        for message in messages:
+            if message.to_user is None:
+                orphaned_ids.append(message.id)
+                continue
+            deliver_after = self.get_deliver_after(message.to_user, now)
+            if deliver_after == now:
+                deliverable.append(message)
+            else:
+                rescheduled.setdefault(deliver_after, []).append(message.id)
+
+        deliveries, delivery_messages = self.get_pending_deliveries(deliverable)
+        statuses = await self.deliver_to_users_external_channels(deliveries, report)
+
+        settled = []
+        retried_since = now - dt.timedelta(seconds=settings.PENDING_RETRY_MAX_AGE_SECONDS)
+        for (user, _), messages_of_delivery, delivery in zip(deliveries, delivery_messages, statuses):
+            retry_deliver_after = self.get_retry_deliver_after(user, delivery, now)
+            for message in messages_of_delivery:
+                if retry_deliver_after is not None and message.created_at > retried_since:
+                    rescheduled.setdefault(retry_deliver_after, []).append(message.id)
+                else:
+                    settled.append(message)
+        notified_ids = [message.id for message in settled if message.to_user.is_accepting_interface_messages]
+        await asyncio.to_thread(self.settle_pending_messages,
+                                [message.id for message in settled] + orphaned_ids, notified_ids, rescheduled)
+
+        report.pending = sum(len(message_ids) for message_ids in rescheduled.values())
+        report.add(NotificationChannelEnum.interface, DeliveryStatusEnum.delivered, len(notified_ids))
+        report.add(NotificationChannelEnum.interface, DeliveryStatusEnum.skipped, len(settled) - len(notified_ids))
+        observe_delivery(NotificationChannelEnum.interface, DeliveryStatusEnum.delivered, len(notified_ids))
+        observe_delivery(NotificationChannelEnum.interface, DeliveryStatusEnum.skipped,
+                         len(settled) - len(notified_ids))
+        return report
+
+    async def dispatch_pending_messages(self, *criteria, batch_size: int = settings.PENDING_DISPATCH_BATCH_SIZE
+                                        ) -> DeliveryReport:
+        """claim deliverable pending messages (matching criteria) by batches with SELECT ... FOR UPDATE SKIP LOCKED
+        until none left, so any number of dispatchers may run in parallel without sending the same message twice,
+        with PENDING_DIGEST messages of one user claimed in the same batch are sent as digests"""
+        report = DeliveryReport()
+        while True:
+            try:
+                messages = await asyncio.to_thread(
+                    self.repo.get_for_update_skip_locked,
+                    MessageModel,
+                    MessageModel.is_notified == False,
+                    MessageModel.deliver_after <= dt.datetime.utcnow(),
+                    *criteria,
+                    limit=batch_size,
+                    # with digests messages of the same user are claimed together, oldest first
+                    order_by=((MessageModel.deliver_after, MessageModel.to_user_uuid, MessageModel.id)
+                              if settings.PENDING_DIGEST else (MessageModel.deliver_after,)),
+                    # recipients are joined to the claim query instead of lazy loading one per message
+                    options=(joinedload(MessageModel.to_user),))
+                if not messages:
+                    await asyncio.to_thread(self.repo.session.rollback)
+                    break
+                report.merge(await self.notify_claimed_pending_messages(messages))
+            except Exception:
+                await asyncio.to_thread(self.repo.session.rollback)
+                raise
+        logger.info(f"pending messages dispatched: {report}")
+        return report
+
+    async def check_availability_and_notify_pending_messages_by_uuid_list(self,
+                                                                          pending_messages_uuids: list[str]
+                                                                          ) -> DeliveryReport:
+        """claim and deliver given pending messages, ones already claimed by other dispatcher are skipped"""
+        return await self.dispatch_pending_messages(in_array(MessageModel.uuid, pending_messages_uuids))
@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+
+import redis
+
+from core.config import settings
+from core.enums import NotificationChannelEnum
+from core.redis_client import AsyncRedisHolder
+from services.notificator.logger_config import logger
+
+# KEYS[1] - bucket hash {tokens, ts}, KEYS[2] - blocked until (ms)
+# ARGV - rate (tokens/s), capacity, requested tokens
+# returns ms to wait before retry, 0 if tokens are taken; redis server clock is used, so all nodes share one clock
+TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local blocked_until = tonumber(redis.call('GET', KEYS[2]) or '0')
+if blocked_until > now then
+    return blocked_until - now
+end
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = math.ceil((requested - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+return wait
+"""
+
+# KEYS[1] - blocked until (ms), ARGV[1] - block for (ms), block is only prolonged, never shortened
+BLOCK_SCRIPT = """
+local t = redis.call('TIME')
+local blocked_until = t[1] * 1000 + math.floor(t[2] / 1000) + tonumber(ARGV[1])
+if blocked_until > tonumber(redis.call('GET', KEYS[1]) or '0') then
+    redis.call('SET', KEYS[1], blocked_until, 'PX', ARGV[1])
+end
+return blocked_until
+"""
+
+
+class LocalTokenBucket:
+    """in-process token bucket, used while redis is not available"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.ts = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def take(self, requested: int) -> float:
+        """seconds to wait before retry, 0 if tokens are taken"""
+        with self._lock:
+            now = time.monotonic()
+            if self.blocked_until > now:
+                return self.blocked_until - now
+            self._refill(now)
+            if self.tokens >= requested:
+                self.tokens -= requested
+                return 0
+            return (requested - self.tokens) / self.rate
+
+    def block(self, seconds: float) -> None:
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def blocked_for(self) -> float:
+        return max(0.0, self.blocked_until - time.monotonic())
+
+    def state(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return {'tokens': round(self.tokens, 2), 'blocked_for': round(max(0.0, self.blocked_until - now), 3)}
+
+
+class TokenBucketRateLimiter:
+    """token bucket of outbound sends of one channel, shared by all processes on all nodes through redis,
+    if redis fails the process falls back to own LocalTokenBucket for RATE_LIMIT_REDIS_RETRY_SECONDS,
+    .block() stops the channel for given seconds (provider asked to retry later),
+    redis is called with asyncio client of the running loop, so waiting for it doesn't block other sends"""
+
+    redis_key_prefix = 'notifications:rate_limit:'
+
+    def __init__(self, name: str, rate: float, capacity: int, redis_holder: AsyncRedisHolder | None = None):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.redis = redis_holder
+        self.local = LocalTokenBucket(rate, capacity)
+        self.bucket_key = f'{self.redis_key_prefix}{name}:bucket'
+        self.blocked_key = f'{self.redis_key_prefix}{name}:blocked'
+        self._redis_failed_at = None
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.blocks = 0
+
+    def _use_redis(self) -> bool:
+        if self.redis is None:
+            return False
+        if self._redis_failed_at is None:
+            return True
+        if time.monotonic() - self._redis_failed_at > settings.RATE_LIMIT_REDIS_RETRY_SECONDS:
+            self._redis_failed_at = None
+            return True
+        return False
+
+    def _redis_failed(self, e: Exception) -> None:
+        logger.warning(f'{self.name} rate limiter: redis failed, using in-process bucket: {e}')
+        self._redis_failed_at = time.monotonic()
+
+    async def _run_script(self, script: str, keys: list[str], args: list):
+        return await self.redis.get().register_script(script)(keys=keys, args=args)
+
+    async def take(self, requested: int = 1) -> float:
+        """seconds to wait before retry, 0 if tokens are taken"""
+        if self._use_redis():
+            try:
+                return await self._run_script(TOKEN_BUCKET_SCRIPT, [self.bucket_key, self.blocked_key],
+                                              [self.rate, self.capacity, requested]) / 1000
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        return self.local.take(requested)
+
+    async def acquire(self, tokens: int = 1) -> None:
+        """wait until 'tokens' sends are allowed, more tokens than bucket capacity are taken by parts"""
+        while tokens > 0:
+            part = min(tokens, self.capacity)
+            wait = await self.take(part)
+            while wait > 0:
+                self.throttled += 1
+                self.throttled_seconds += wait
+                await asyncio.sleep(wait)
+                wait = await self.take(part)
+            tokens -= part
+
+    async def block(self, seconds: float) -> None:
+        logger.warning(f'{self.name} rate limiter: channel blocked for {seconds}s')
+        self.blocks += 1
+        self.local.block(seconds)
+        if self._use_redis():
+            try:
+                await self._run_script(BLOCK_SCRIPT, [self.blocked_key], [max(1, int(seconds * 1000))])
+            except redis.RedisError as e:
+                self._redis_failed(e)
+
+    def blocked_for(self) -> float:
+        """seconds the channel stays blocked by blocks of this process (every block is copied to local bucket)"""
+        return self.local.blocked_for()
+
+    async def state(self) -> dict:
+        state = {'rate': self.rate, 'capacity': self.capacity, 'backend': 'local',
+                 'throttled': self.throttled, 'throttled_seconds': round(self.throttled_seconds, 3),
+                 'blocks': self.blocks}
+        if self._use_redis():
+            try:
+                client = self.redis.get()
+                tokens, ts = await client.hmget(self.bucket_key, 'tokens', 'ts')
+                blocked_for = await client.pttl(self.blocked_key)
+                return {**state, 'backend': 'redis',
+                        # tokens left after the last take, refill since then isn't counted
+                        'tokens': self.capacity if tokens is None else round(float(tokens), 2),
+                        'blocked_for': max(0, blocked_for) / 1000}
+            except redis.RedisError as e:
+                self._redis_failed(e)
+        return {**state, **self.local.state()}
+
+
+# clients are opened in every loop the limiters are used in, owner of the loop awaits .aclose() before it's gone
+rate_limit_redis = AsyncRedisHolder('rate limit',
+                                    host=settings.REDIS_HOST, port=settings.REDIS_PORT,
+                                    socket_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT,
+                                    socket_connect_timeout=settings.RATE_LIMIT_REDIS_TIMEOUT)
+_redis_holder = rate_limit_redis if settings.RATE_LIMIT_REDIS else None
+
+rate_limiters = {
+    NotificationChannelEnum.email: TokenBucketRateLimiter(
+        NotificationChannelEnum.email.value, settings.EMAIL_RATE_LIMIT, settings.EMAIL_RATE_BURST, _redis_holder),
+    NotificationChannelEnum.telegram: TokenBucketRateLimiter(
+        NotificationChannelEnum.telegram.value, settings.TELEGRAM_RATE_LIMIT, settings.TELEGRAM_RATE_BURST,
+        _redis_holder),
+}
@@ -0,0 +1,151 @@
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from core.config import settings
+from services.notificator.logger_config import logger
+
+
+class SMTPConnectionPool:
+    """keeps up to 'size' long-lived smtp sessions per process and hands them out to senders,
+    - idle sessions are checked with NOOP before reuse
+    - broken sessions are dropped and reopened on the next checkout"""
+
+    def __init__(self, host: str, port: int, size: int, idle_check_seconds: int, timeout: int):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_check_seconds = idle_check_seconds
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        smtp.ehlo()
+        logger.debug(f'smtp session opened to {self.host}:{self.port}')
+        return smtp
+
+    @staticmethod
+    def _is_alive(smtp: smtplib.SMTP) -> bool:
+        try:
+            return smtp.noop()[0] == 250
+        except OSError:
+            return False
+
+    @staticmethod
+    def _close(smtp: smtplib.SMTP) -> None:
+        try:
+            smtp.quit()
+        except OSError:
+            smtp.close()
+
+    def _checkout(self) -> smtplib.SMTP:
+        while True:
+            try:
+                smtp, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < self.idle_check_seconds or self._is_alive(smtp):
+                return smtp
+            self._close(smtp)
+
+    @contextmanager
+    def connection(self):
+        """checkout session for exclusive use, blocks while all 'size' sessions are busy"""
+        self._slots.acquire()
+        smtp = None
+        try:
+            smtp = self._checkout()
+            yield smtp
+        except smtplib.SMTPServerDisconnected:
+            if smtp is not None:
+                smtp.close()
+                smtp = None
+            raise
+        except smtplib.SMTPException:
+            # message-level error (refused recipient etc.), session itself is still usable
+            raise
+        except OSError:
+            if smtp is not None:
+                smtp.close()
+                smtp = None
+            raise
+        finally:
+            if smtp is not None:
+                self._idle.put((smtp, time.monotonic()))
+            self._slots.release()
+
+    def _send_with_retry(self, send):
+        """send(smtp) over pooled session, if session was dropped by server - reconnect and retry once"""
+        for attempt in range(2):
+            try:
+                with self.connection() as smtp:
+                    return send(smtp)
+            except smtplib.SMTPServerDisconnected:
+                if attempt:
+                    raise
+                logger.warning(f'smtp session to {self.host}:{self.port} was dropped, reconnecting')
+
+    def sendmail(self, from_addr: str, to_addrs: list[str], data: bytes) -> dict[str, tuple[int, bytes]]:
+        """send already encoded message, returns refused recipients {address: (code, reply)},
+        raises SMTPRecipientsRefused if all of them are refused"""
+        return self._send_with_retry(lambda smtp: smtp.sendmail(from_addr, to_addrs, data))
+
+    def send_envelopes(self, envelopes: list[tuple[str, list[str], bytes]]) -> dict[str, Exception]:
+        """send many already encoded messages (from_addr, to_addrs, data) one after another over the same session,
+        returns {address: error} for recipients the message was not sent to"""
+        failed = {}
+        pending = deque(envelopes)
+        retried = False
+        while pending:
+            try:
+                with self.connection() as smtp:
+                    while pending:
+                        from_addr, to_addrs, data = pending[0]
+                        try:
+                            refused = smtp.sendmail(from_addr, to_addrs, data)
+                        except smtplib.SMTPServerDisconnected:
+                            raise
+                        except smtplib.SMTPRecipientsRefused as e:
+                            refused = e.recipients
+                        except smtplib.SMTPException as e:
+                            failed.update(dict.fromkeys(to_addrs, e))
+                            refused = {}
+                        for address, (code, reply) in refused.items():
+                            failed[address] = smtplib.SMTPRecipientsRefused({address: (code, reply)})
+                        pending.popleft()
+                        retried = False
+            except smtplib.SMTPServerDisconnected as e:
+                # stale session: retry current message once with a fresh session
+                if retried:
+                    failed.update(dict.fromkeys(pending.popleft()[1], e))
+                retried = not retried
+            except OSError as e:
+                failed.update(dict.fromkeys(pending.popleft()[1], e))
+                retried = False
+        return failed
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                smtp, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(smtp)
+
+    def reset(self) -> None:
+        """forget sessions inherited from parent process (they must not be shared after fork)"""
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+
+smtp_pool = SMTPConnectionPool(settings.SMTP_HOST, settings.SMTP_PORT,
+                               size=settings.SMTP_POOL_SIZE,
+                               idle_check_seconds=settings.SMTP_POOL_IDLE_CHECK_SECONDS,
+                               timeout=settings.SMTP_TIMEOUT)
+os.register_at_fork(after_in_child=smtp_pool.reset)
@@ -0,0 +1,105 @@
+import datetime as dt
+import smtplib
+import uuid
+
+import pytest
+import sqlalchemy as sa
+
+from core import config
+from core.enums import DeliveryStatusEnum, MessagePriorityEnum, NotificationChannelEnum
+from db import SessionLocal, engine_sync
+from db.expressions import in_array
+from db.models.message import MessageModel
+from db.models.user import UserModel
+from db.repository_sync import SqlAlchemyRepositorySync
+from db.serializers.message import MessageCreateSerializer
+from db.serializers.user import UserCreateSerializer
+from services.notificator.notificator import Notificator
+from services.notificator.smtp_pool import smtp_pool
+
+
+@pytest.fixture
+def repo():
+    session = SessionLocal()
+    yield SqlAlchemyRepositorySync(session)
+    session.close()
+
+
+@pytest.fixture
+def seed_pending_messages(repo, monkeypatch):
+    """creates one pending message deliverable now per new user, users accept only interface messages
+    (unless user_fields say otherwise), so nothing is sent to external channels, seeded rows are removed after test"""
+    monkeypatch.setattr(config, 'USER_NOTIFICATION_AVAILABLE_HOURS', list(range(24)))
+    user_uuids = []
+
+    def inner(count: int, **user_fields) -> list[str]:
+        user_fields = {'is_accepting_emails': False, 'is_accepting_telegram': False,
+                       'is_accepting_interface_messages': True, **user_fields}
+        users = repo.create_many_returning(
+            UserModel,
+            [UserCreateSerializer(uuid=str(uuid.uuid4()), email=f'test-dispatch-{uuid.uuid4().hex[:16]}@cinema.online',
+                                  timezone='UTC+3', **user_fields)
+             for _ in range(count)],
+            UserModel.uuid)
+        user_uuids.extend(user.uuid for user in users)
+        messages = repo.create_many_returning(
+            MessageModel,
+            [MessageCreateSerializer(to_user_uuid=user.uuid, text='test', is_notified=False,
+                                     priority=MessagePriorityEnum.individual_pending,
+                                     deliver_after=dt.datetime.utcnow() - dt.timedelta(minutes=1))
+             for user in users],
+            MessageModel.uuid)
+        return [message.uuid for message in messages]
+
+    yield inner
+    repo.session.rollback()
+    repo.session.execute(sa.delete(MessageModel).where(in_array(MessageModel.to_user_uuid, user_uuids)))
+    repo.session.execute(sa.delete(UserModel).where(in_array(UserModel.uuid, user_uuids)))
+    repo.session.commit()
+
+
+@pytest.fixture
+def statements():
+    """sql statements executed by notifications postgres sync engine"""
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    sa.event.listen(engine_sync, 'before_cursor_execute', before_cursor_execute)
+    yield executed
+    sa.event.remove(engine_sync, 'before_cursor_execute', before_cursor_execute)
+
+
+@pytest.mark.asyncio
+async def test_pending_dispatch_statements_dont_depend_on_batch_size(repo, seed_pending_messages, statements):
+    counts = []
+    for count in (5, 50):
+        message_uuids = seed_pending_messages(count)
+        statements.clear()
+        report = await Notificator(repo).check_availability_and_notify_pending_messages_by_uuid_list(message_uuids)
+        counts.append(len(statements))
+
+        assert report.users == count
+        assert report.channels[NotificationChannelEnum.interface][DeliveryStatusEnum.delivered] == count
+    assert counts[0] == counts[1]
+
+
+@pytest.mark.asyncio
+async def test_pending_message_is_rescheduled_if_email_fails(repo, seed_pending_messages, monkeypatch):
+    def sendmail(from_addr, to_addrs, data):
+        raise smtplib.SMTPResponseException(550, b'mailbox unavailable')
+
+    monkeypatch.setattr(smtp_pool, 'sendmail', sendmail)
+    message_uuids = seed_pending_messages(2, is_accepting_emails=True)
+    started_at = dt.datetime.utcnow()
+    report = await Notificator(repo).check_availability_and_notify_pending_messages_by_uuid_list(message_uuids)
+
+    assert report.channels[NotificationChannelEnum.email][DeliveryStatusEnum.failed] == 2
+    assert report.pending == 2
+    messages = repo.session.scalars(sa.select(MessageModel).where(in_array(MessageModel.uuid, message_uuids))).all()
+    assert len(messages) == 2
+    for message in messages:
+        assert not message.is_notified
+        assert message.deliver_after is not None
+        assert message.deliver_after > started_at